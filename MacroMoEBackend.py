@@ -0,0 +1,2413 @@
+import sys, json, sqlite3, asyncio, importlib.util, argparse, queue, contextlib, itertools, hashlib, array, cProfile, pstats, urllib.error, urllib.parse, http.client, io, os, subprocess, signal, base64, re, math, multiprocessing, time, datetime, threading, gc
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# Pillow is imported on the first image, not at startup; without it images are sent as-is
+HAS_PIL = importlib.util.find_spec("PIL") is not None
+
+# --- CONFIGURATION ---
+OLLAMA_HOST = os.getenv("AI_OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+POOL_SIZE = max(1, int(os.getenv("AI_POOL_SIZE", "4")))
+ENGINE_WORKERS = max(1, int(os.getenv("AI_ENGINE_WORKERS", "8")))
+ENGINE_SESSIONS = max(1, int(os.getenv("AI_ENGINE_SESSIONS", "64"))) # idle sessions a SessionEngine keeps in memory
+BASE_DIR = os.getenv("AI_STUDIO_DIR", os.path.join(os.path.expanduser("~"), "ai_studio"))
+HISTORY_DIR = os.path.join(BASE_DIR, "chats") # legacy one-JSON-per-chat layout, migrated into CHAT_DB
+CHAT_DB = os.path.join(BASE_DIR, "chats.db")
+HISTORY_PAGE = 500 # messages loaded when a chat is opened; older ones stay on disk
+HISTORY_KEEP = int(os.getenv("AI_HISTORY_KEEP", "200")) # saved messages kept in memory per session (0 = all)
+HISTORY_RELOAD = 50 # older messages fetched per step when a legacy-layout prompt reaches past memory
+GC_MODE = os.getenv("AI_GC", "after_images") # "after_images": collect in the background after vision turns; "always"; "off"
+MEMORY_FILE = os.path.join(BASE_DIR, "memory.json")
+THINKING_LOG = os.path.join(BASE_DIR, "thinking.jsonl")
+LOG_THINKING = os.getenv("AI_LOG_THINKING", "0") == "1"  # keep hidden <think> text for debugging
+CPU_CORES = max(1, multiprocessing.cpu_count() - 2)
+
+def ensure_parent(path):
+    # Data directories are created on first write, never at import
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return path
+
+# [VERIFIED] Dynamic Model Loading
+MODELS = {
+    "logic": os.getenv("AI_LOGIC_MODEL", "phi4-mini-reasoning:3.8b-q4_K_M"), 
+    "vision": os.getenv("AI_VISION_MODEL", "qwen3-vl:4b"), 
+    "chat": os.getenv("AI_CHAT_MODEL", "gemma3:4b")
+}
+
+# Router: "semantic" (embeddings vs. per-expert centroids, keyword fallback) or "keyword"
+ROUTER_MODE = os.getenv("AI_ROUTER", "semantic")
+EMBED_MODEL = os.getenv("AI_EMBED_MODEL", "nomic-embed-text")
+ROUTER_MIN_MARGIN = float(os.getenv("AI_ROUTER_MIN_MARGIN", "0.03"))
+
+# Residency: keep_alive per request from recent usage; with a VRAM budget, cold experts are
+# unloaded explicitly and the likely next expert is pre-loaded between turns
+KEEP_ALIVE = {"hot": "30m", "warm": "5m", "cold": "1m"}
+VRAM_BUDGET_MB = int(os.getenv("AI_VRAM_BUDGET_MB", "0")) # 0 = unknown: leave eviction to Ollama
+MODEL_SIZE_MB = int(os.getenv("AI_MODEL_SIZE_MB", "4096")) # assumed size of a model never seen in /api/ps
+PREWARM = os.getenv("AI_PREWARM", "1") == "1"
+
+# Context: each request is packed to num_ctx minus the room kept free for the answer
+NUM_CTX = int(os.getenv("AI_NUM_CTX", "4096"))
+REPLY_TOKENS = int(os.getenv("AI_REPLY_TOKENS", "1024"))
+PROMPT_LAYOUT = os.getenv("AI_PROMPT_LAYOUT", "stable") # "stable" (KV-cache friendly prefix) or "legacy"
+FILE_INDEX_DB = os.path.join(BASE_DIR, "file_index.db") # chunk index of attached files
+RETRIEVE_TOP_K = int(os.getenv("AI_RETRIEVE_TOP_K", "6")) # chunks per attached file offered to the packer
+
+# Vision: images are downscaled (needs Pillow) and their encoded payloads cached by content hash
+IMAGE_FILES = ('.png', '.jpg', '.jpeg')
+IMAGE_MAX_SIDE = int(os.getenv("AI_IMAGE_MAX_SIDE", "1344")) # longest side sent to the vision expert, 0 = original
+IMAGE_CACHE_MB = int(os.getenv("AI_IMAGE_CACHE_MB", "64"))
+
+# Response cache (off by default): replays answers to repeated standalone questions
+RESPONSE_CACHE = os.getenv("AI_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_DB = os.path.join(BASE_DIR, "responses.db")
+RESPONSE_CACHE_TTL = float(os.getenv("AI_RESPONSE_CACHE_TTL", "86400")) # seconds
+RESPONSE_CACHE_MB = int(os.getenv("AI_RESPONSE_CACHE_MB", "16"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("AI_RESPONSE_CACHE_SIMILARITY", "0")) # e.g. 0.95 for near duplicates, 0 = exact only
+
+# Telemetry: one JSONL record per request (rotated), plus cProfile of the next request on demand
+METRICS = os.getenv("AI_METRICS", "1") == "1"
+METRICS_FILE = os.path.join(BASE_DIR, "metrics.jsonl")
+METRICS_MAX_MB = int(os.getenv("AI_METRICS_MAX_MB", "5"))
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+PROFILE_NEXT = os.getenv("AI_PROFILE", "0") == "1" # profile the first request (or type /profile)
+
+# Commands: approved <cmd>s run on a small pool, read-only ones cached briefly
+COMMAND_WORKERS = max(1, int(os.getenv("AI_COMMAND_WORKERS", "4"))) # commands (child processes) running at once
+COMMAND_TIMEOUT = float(os.getenv("AI_COMMAND_TIMEOUT", "10"))
+COMMAND_CACHE_TTL = float(os.getenv("AI_COMMAND_CACHE_TTL", "30")) # seconds, 0 = never cache
+
+# Headless server: OpenAI-style /v1/chat/completions (python MacroMoEBackend.py)
+SERVER_HOST = os.getenv("AI_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("AI_SERVER_PORT", "8000"))
+SERVER_QUEUE = int(os.getenv("AI_SERVER_QUEUE", "32")) # requests waiting for a worker before answering 429
+SERVER_KEY = os.getenv("AI_SERVER_KEY", "") # if set, clients must send "Authorization: Bearer <key>"
+APPROVAL_TTL = float(os.getenv("AI_APPROVAL_TTL", "600")) # seconds a requested command stays approvable
+
+# ==========================================
+#        TRANSPORT: POOLED OLLAMA LINK
+# ==========================================
+
+class PooledResponse:
+    # The socket only goes back to the pool if the body was fully drained,
+    # otherwise (STOP mid-stream, errors) it is closed and redialed later.
+    def __init__(self, pool, conn, resp):
+        self.pool, self.conn, self.resp = pool, conn, resp
+        self.status = resp.status
+
+    def __iter__(self):
+        return iter(self.resp)
+
+    def read(self):
+        return self.resp.read()
+
+    def close(self):
+        if self.conn is None: return
+        reusable = self.resp.isclosed() and not self.resp.will_close
+        if not reusable: self.resp.close()
+        self.pool.release(self.conn, reusable)
+        self.conn = None
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+class OllamaTransport:
+    def __init__(self, base_url=OLLAMA_HOST, pool_size=POOL_SIZE):
+        parts = urllib.parse.urlsplit(base_url)
+        is_https = parts.scheme == "https"
+        self.base_url = base_url.rstrip("/")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if is_https else 80)
+        self.conn_cls = http.client.HTTPSConnection if is_https else http.client.HTTPConnection
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {"opened": 0, "reused": 0, "retries": 0}
+
+    def acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            if self.idle:
+                self.stats["reused"] += 1
+                return self.idle.pop(), True
+            self.stats["opened"] += 1
+        return self.conn_cls(self.host, self.port), False
+
+    def release(self, conn, reusable=True):
+        if reusable:
+            with self.lock: self.idle.append(conn)
+        else:
+            conn.close()
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle: conn.close()
+
+    def request(self, method, path, body=None, timeout=30):
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        while True:
+            conn, reused = self.acquire()
+            conn.timeout = timeout
+            if conn.sock: conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+            except TimeoutError:
+                self.release(conn, False)
+                raise
+            except (http.client.HTTPException, OSError) as e:
+                self.release(conn, False)
+                if reused:
+                    # Keep-alive socket went stale (server restart / idle timeout): drop the rest and redial
+                    self.stats["retries"] += 1
+                    self.close()
+                    continue
+                raise urllib.error.URLError(e)
+
+            if resp.status >= 400:
+                err_body = resp.read()
+                self.release(conn, not resp.will_close)
+                raise urllib.error.HTTPError(self.base_url + path, resp.status, resp.reason, resp.headers, io.BytesIO(err_body))
+            return PooledResponse(self, conn, resp)
+
+    def get_json(self, path, timeout=10):
+        with self.request("GET", path, timeout=timeout) as r: return json.loads(r.read() or b"{}")
+
+    def post_json(self, path, body, timeout=30):
+        with self.request("POST", path, body, timeout=timeout) as r: return json.loads(r.read() or b"{}")
+
+class AsyncOllamaTransport:
+    # asyncio twin of OllamaTransport. One event loop multiplexes many streams, and a
+    # consumer that stops pulling lines stops the socket reads (TCP backpressure).
+    def __init__(self, base_url=OLLAMA_HOST, pool_size=POOL_SIZE):
+        parts = urllib.parse.urlsplit(base_url)
+        is_https = parts.scheme == "https"
+        self.base_url = base_url.rstrip("/")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if is_https else 80)
+        self.ssl = True if is_https else None
+        self.pool_size = pool_size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {"opened": 0, "reused": 0, "retries": 0}
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                if not self.idle: break
+                owner, reader, writer = self.idle.pop()
+            # Sockets are bound to the loop that opened them
+            if owner is loop and not writer.is_closing() and not reader.at_eof():
+                self.stats["reused"] += 1
+                return reader, writer, True
+            try: writer.close()
+            except RuntimeError: pass
+        self.stats["opened"] += 1
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        except OSError as e:
+            raise urllib.error.URLError(e)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable=True):
+        with self.lock:
+            if reusable and len(self.idle) < self.pool_size:
+                self.idle.append((asyncio.get_running_loop(), reader, writer))
+                return
+        writer.close()
+
+    async def read_blocks(self, reader, headers, timeout):
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                size = int((await asyncio.wait_for(reader.readline(), timeout)).split(b";")[0], 16)
+                if size == 0:
+                    while (await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""): pass
+                    return
+                block = await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+                yield block[:-2]
+        elif "content-length" in headers:
+            yield await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+        else:
+            while block := await asyncio.wait_for(reader.read(65536), timeout): yield block
+
+    async def stream(self, method, path, body=None, timeout=30, on_open=None):
+        # on_open() is called once the response headers are in, before the first line
+        payload = json.dumps(body).encode('utf-8') if body is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n").encode('ascii')
+        while True:
+            reader, writer, reused = await self.acquire()
+            try:
+                writer.write(head + payload)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), timeout)
+            except asyncio.TimeoutError:
+                writer.close()
+                raise
+            except OSError as e:
+                status_line, error = b"", e
+            else:
+                error = "Connection closed by server"
+            if status_line: break
+            writer.close()
+            if not reused: raise urllib.error.URLError(error)
+            self.stats["retries"] += 1
+
+        done, reusable = False, False
+        try:
+            _, status, reason = status_line.decode('latin-1').split(" ", 2)
+            headers = {}
+            while (h := await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+                k, _, v = h.decode('latin-1').partition(":")
+                headers[k.strip().lower()] = v.strip()
+            reusable = headers.get("connection", "").lower() != "close" and \
+                ("chunked" in headers.get("transfer-encoding", "").lower() or "content-length" in headers)
+
+            if int(status) >= 400:
+                err_body = b"".join([b async for b in self.read_blocks(reader, headers, timeout)])
+                done = True
+                raise urllib.error.HTTPError(self.base_url + path, int(status), reason.strip(), headers, io.BytesIO(err_body))
+
+            if on_open: on_open()
+            pending = b""
+            async for block in self.read_blocks(reader, headers, timeout):
+                pending += block
+                *lines, pending = pending.split(b"\n")
+                for line in lines: yield line + b"\n"
+            if pending: yield pending
+            done = True
+        finally:
+            self.release(reader, writer, done and reusable)
+
+    async def get_json(self, path, timeout=10):
+        return json.loads(b"".join([line async for line in self.stream("GET", path, timeout=timeout)]) or b"{}")
+
+    async def post_json(self, path, body, timeout=30):
+        return json.loads(b"".join([line async for line in self.stream("POST", path, body, timeout=timeout)]) or b"{}")
+
+# ==========================================
+#        STORAGE: INDEXED CHAT HISTORY
+# ==========================================
+
+class ChatStore:
+    # SQLite store: each turn appends only its new messages, and the sidebar lists
+    # chats from an index on last update instead of stat()ing every file.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chats (id TEXT PRIMARY KEY, created REAL, updated REAL, count INTEGER DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS chats_by_recency ON chats(updated DESC);
+        CREATE TABLE IF NOT EXISTS messages (
+            chat_id TEXT, seq INTEGER, role TEXT, content TEXT, extra TEXT,
+            PRIMARY KEY (chat_id, seq));
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    # Full-text index over message content, kept in step with `messages` by triggers
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='rowid');
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ins AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content); END;
+        CREATE TRIGGER IF NOT EXISTS messages_fts_del AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END;
+    """
+
+    def __init__(self, path=CHAT_DB, legacy_dir=HISTORY_DIR):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self.lock = threading.RLock()
+        self._db = None
+        self.has_fts = False
+
+    @property
+    def db(self):
+        # Opened on first use so importing/constructing the backend stays cheap
+        with self.lock:
+            if self._db is None:
+                db = sqlite3.connect(ensure_parent(self.path), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(self.SCHEMA)
+                self._db = db
+                self.init_fts()
+                if not self.get_meta("json_migrated"): self.migrate_json(self.legacy_dir)
+            return self._db
+
+    def close(self):
+        with self.lock:
+            if self._db is not None: self._db.close()
+            self._db = None
+
+    def init_fts(self):
+        try:
+            self._db.executescript(self.FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            return # SQLite built without FTS5: search() falls back to LIKE
+        self.has_fts = True
+        if not self.get_meta("fts_built"):
+            # Index messages stored before search existed
+            with self._db:
+                self._db.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts_built', '1')")
+
+    def get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def exists(self, chat_id):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone() is not None
+
+    def append(self, chat_id, messages, when=None):
+        if not messages: return
+        when = when or time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO chats (id, created, updated, count) VALUES (?, ?, ?, 0)", (chat_id, when, when))
+            start = self.db.execute("SELECT count FROM chats WHERE id = ?", (chat_id,)).fetchone()[0]
+            rows = []
+            for i, msg in enumerate(messages):
+                extra = {k: v for k, v in msg.items() if k not in ("role", "content")}
+                rows.append((chat_id, start + i, msg.get("role"), msg.get("content", ""), json.dumps(extra) if extra else None))
+            self.db.executemany("INSERT INTO messages (chat_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.execute("UPDATE chats SET count = ?, updated = ? WHERE id = ?", (start + len(rows), when, chat_id))
+
+    def load(self, chat_id, limit=None, before=None):
+        # Newest `limit` messages (optionally older than seq `before`), oldest first
+        sql = "SELECT role, content, extra FROM messages WHERE chat_id = ?"
+        args = [chat_id]
+        if before is not None:
+            sql += " AND seq < ?"
+            args.append(before)
+        sql += " ORDER BY seq DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self.lock: rows = self.db.execute(sql, args).fetchall()
+        history = []
+        for role, content, extra in reversed(rows):
+            msg = {"role": role, "content": content}
+            if extra: msg.update(json.loads(extra))
+            history.append(msg)
+        return history
+
+    def count(self, chat_id):
+        with self.lock:
+            row = self.db.execute("SELECT count FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return row[0] if row else 0
+
+    def list_chats(self, limit=None, offset=0):
+        with self.lock:
+            rows = self.db.execute("SELECT id FROM chats ORDER BY updated DESC LIMIT ? OFFSET ?",
+                                   (-1 if limit is None else limit, offset)).fetchall()
+        return [r[0] for r in rows]
+
+    def search(self, query, limit=20):
+        # -> [(chat_id, snippet)], best-matching chats first; every word must match (prefixes allowed)
+        words = re.findall(r"\w+", query)
+        if not words: return []
+        with self.lock:
+            db = self.db
+            if self.has_fts:
+                match = " ".join(f'"{w}"*' for w in words)
+                # Rank inside FTS first (ORDER BY rank uses its fast path), join only the top hits
+                rows = db.execute(
+                    "SELECT m.chat_id, hits.snip FROM (SELECT rowid, rank, snippet(messages_fts, 0, '[', ']', '...', 12) AS snip "
+                    "FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?) AS hits "
+                    "JOIN messages m ON m.rowid = hits.rowid ORDER BY hits.rank", (match, limit * 5)).fetchall()
+            else:
+                sql = "SELECT m.chat_id, m.content FROM messages m JOIN chats c ON c.id = m.chat_id WHERE " + \
+                      " AND ".join(["m.content LIKE ?"] * len(words)) + " ORDER BY c.updated DESC LIMIT ?"
+                rows = db.execute(sql, [f"%{w}%" for w in words] + [limit * 5]).fetchall()
+                rows = [(chat_id, content[:80]) for chat_id, content in rows]
+        results, seen = [], set()
+        for chat_id, snippet in rows:
+            if chat_id in seen: continue
+            seen.add(chat_id)
+            results.append((chat_id, snippet.replace("\n", " ")))
+            if len(results) == limit: break
+        return results
+
+    def delete(self, chat_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            found = self.db.execute("DELETE FROM chats WHERE id = ?", (chat_id,)).rowcount > 0
+        # A migrated chat's old JSON copy goes too: deleting a chat used to remove its file
+        try:
+            os.remove(os.path.join(self.legacy_dir, os.path.basename(chat_id) + ".json.migrated"))
+            found = True
+        except OSError: pass
+        return found
+
+    def migrate_json(self, legacy_dir):
+        # Imports ~/ai_studio/chats/<id>.json (keeping its mtime as "last updated") and
+        # renames each file to <id>.json.migrated so nothing is lost if something goes wrong
+        migrated = 0
+        if os.path.isdir(legacy_dir):
+            for name in os.listdir(legacy_dir):
+                if not name.endswith(".json"): continue
+                path = os.path.join(legacy_dir, name)
+                chat_id = name[:-5]
+                try:
+                    with open(path, "r", encoding='utf-8') as f: history = json.load(f)
+                    if not isinstance(history, list): continue
+                    mtime = os.path.getmtime(path)
+                    with self.lock:
+                        if not self.exists(chat_id): self.append(chat_id, history, when=mtime)
+                    os.replace(path, path + ".migrated")
+                    migrated += 1
+                except (OSError, ValueError): pass
+        with self.lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+        return migrated
+
+# ==========================================
+#        ROUTER: EXPERT SELECTION
+# ==========================================
+
+LOGIC_TRIGGERS = ["code", "math", "plan", "calc", "network", "ping", "internet", "status", "cmd", "ipconfig", "ifconfig", "ls", "dir"]
+# The same triggers as whole words, each form spelled out (regex): "planet", "calcium",
+# "dirty", "codependent", "else" or "explain" don't match
+LOGIC_WORDS = [
+    r"cod(e|es|ed|ing)", r"maths?", r"plan(s|ned|ning)?", r"calc(ulate|ulates|ulated|ulating|ulation|ulator)?",
+    r"network(s|ing)?", r"ping(s|ed|ing)?", r"internet", r"status", r"cmd", r"ipconfig", r"ifconfig", r"ls", r"dir",
+]
+
+# Seed prompts that define each expert's centroid. Vision is picked by attachments, not here.
+ROUTER_EXAMPLES = {
+    "logic": [
+        "Write a Python function that parses a CSV file",
+        "Why does this code throw a null pointer exception?",
+        "Fix the bug in my JavaScript loop",
+        "Solve 3x + 7 = 22 for x",
+        "What is the derivative of x^2 * sin(x)?",
+        "Calculate the compound interest on 5000 at 4% for 10 years",
+        "Make a step by step plan to migrate our database",
+        "Check my network connection",
+        "Ping google.com and tell me the latency",
+        "What is my IP address?",
+        "List the files in the current directory",
+        "Show running network connections with netstat",
+        "Run ipconfig and explain the output",
+        "Is the internet down? Check the gateway status",
+        "Prove that the square root of 2 is irrational",
+        "Optimize this SQL query",
+    ],
+    "chat": [
+        "Hi, how are you today?",
+        "Hello!",
+        "Tell me a joke",
+        "Write a short poem about the ocean",
+        "What is the capital of France?",
+        "Explain how photosynthesis works in simple terms",
+        "Recommend a good book for a long flight",
+        "Summarize the plot of Romeo and Juliet",
+        "How do I make a good cup of coffee?",
+        "What should I cook for dinner tonight?",
+        "Translate 'good morning' into Spanish",
+        "Give me tips for a job interview",
+        "Thanks, that was helpful",
+        "Who painted the Mona Lisa?",
+        "Help me write a birthday message for my sister",
+        "What are some fun things to do this weekend?",
+    ],
+}
+
+class KeywordRouter:
+    # The trigger words, matched as whole words only
+    def __init__(self, words=LOGIC_WORDS):
+        self.pattern = re.compile(r"\b(?:" + "|".join(words) + r")\b", re.IGNORECASE)
+        self.stats = {"keyword": 0}
+
+    def route(self, prompt):
+        self.stats["keyword"] += 1
+        return ("logic" if self.pattern.search(prompt) else "chat"), 1.0, "keyword"
+
+def normalize(vec):
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+class OllamaEmbedder:
+    def __init__(self, transport, model=EMBED_MODEL):
+        self.transport, self.model = transport, model
+
+    def __call__(self, texts):
+        return self.transport.post_json("/api/embed", {"model": self.model, "input": texts}, timeout=10)["embeddings"]
+
+class SemanticRouter:
+    # Nearest expert centroid by cosine similarity. Falls back to the keyword rules when the
+    # best and second-best experts are closer than `min_margin`, or the embedder fails.
+    def __init__(self, embedder, fallback=None, examples=ROUTER_EXAMPLES, min_margin=ROUTER_MIN_MARGIN, cache_size=512):
+        self.embedder = embedder
+        self.fallback = fallback or KeywordRouter()
+        self.examples = examples
+        self.min_margin = min_margin
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.centroids = None
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"semantic": 0, "fallback": 0, "cache_hits": 0, "errors": 0, "seconds": 0.0}
+
+    def build_centroids(self):
+        names = list(self.examples)
+        texts = [t for name in names for t in self.examples[name]]
+        vectors = [normalize(v) for v in self.embedder(texts)]
+        centroids, i = {}, 0
+        for name in names:
+            group = vectors[i:i + len(self.examples[name])]
+            i += len(group)
+            centroids[name] = normalize([sum(col) / len(group) for col in zip(*group)])
+        return centroids
+
+    def embed(self, prompt):
+        key = " ".join(prompt.lower().split())
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return self.cache[key]
+        vec = normalize(self.embedder([key])[0])
+        with self.lock:
+            self.cache[key] = vec
+            if len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+        return vec
+
+    def route(self, prompt):
+        t0 = time.perf_counter()
+        try:
+            if not prompt.strip() or time.time() < self.retry_at: raise LookupError
+            if self.centroids is None: self.centroids = self.build_centroids()
+            vec = self.embed(prompt)
+            scores = sorted(((sum(a * b for a, b in zip(vec, c)), name) for name, c in self.centroids.items()), reverse=True)
+            margin = scores[0][0] - scores[1][0]
+            if margin < self.min_margin: raise LookupError
+            self.stats["semantic"] += 1
+            return scores[0][1], margin, "semantic"
+        except LookupError:
+            pass
+        except Exception:
+            # Embedding model missing / Ollama down: don't pay for it on every prompt
+            self.stats["errors"] += 1
+            self.retry_at = time.time() + 60
+        finally:
+            self.stats["seconds"] += time.perf_counter() - t0
+        self.stats["fallback"] += 1
+        return self.fallback.route(prompt)
+
+def make_router(transport):
+    if ROUTER_MODE == "keyword": return KeywordRouter()
+    return SemanticRouter(OllamaEmbedder(transport))
+
+# ==========================================
+#        RESIDENCY: EXPERT VRAM SCHEDULING
+# ==========================================
+
+class ResidencyManager:
+    def __init__(self, transport, budget_mb=VRAM_BUDGET_MB, prewarm=PREWARM, window=20, ps_interval=10.0):
+        self.transport = transport
+        self.budget = budget_mb * 2**20
+        self.prewarm_enabled = prewarm
+        self.recent = deque(maxlen=window)
+        self.transitions = {}   # model -> {model used right after it: count}
+        self.resident = {}      # model -> bytes, from /api/ps plus our own bookkeeping
+        self.sizes = {}
+        self.prewarmed = set()
+        self.ps_interval = ps_interval
+        self.last_ps = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "swaps": 0, "loads": 0, "load_seconds": 0.0,
+                      "unloads": 0, "prewarms": 0, "prewarm_hits": 0}
+
+    def sync(self, force=False):
+        if not force and time.time() - self.last_ps < self.ps_interval: return
+        self.last_ps = time.time()
+        try:
+            models = self.transport.get_json("/api/ps", timeout=2).get("models", [])
+        except Exception: return # keep our own bookkeeping
+        with self.lock:
+            self.resident = {m["name"]: m.get("size_vram") or m.get("size") or 0 for m in models}
+            for name, size in self.resident.items():
+                if size: self.sizes[name] = size
+
+    def size(self, model):
+        return self.sizes.get(model, MODEL_SIZE_MB * 2**20)
+
+    def frequency(self, model):
+        return self.recent.count(model) / len(self.recent) if self.recent else 0.0
+
+    def predict_next(self, model):
+        counts = self.transitions.get(model)
+        if not counts: return None
+        nxt, n = max(counts.items(), key=lambda kv: kv[1])
+        return nxt if n >= 2 else None
+
+    def keep_alive_for(self, model):
+        f = self.frequency(model)
+        return KEEP_ALIVE["hot"] if f >= 0.5 else KEEP_ALIVE["warm"] if f >= 0.2 else KEEP_ALIVE["cold"]
+
+    def victims(self, model, protect):
+        # Models to unload so `model` fits the budget: never `model`, others least-used first
+        if not self.budget: return []
+        used = sum(self.resident.values()) + (0 if model in self.resident else self.size(model))
+        out = []
+        for m in sorted((m for m in self.resident if m != model), key=lambda m: (m in protect, self.frequency(m))):
+            if used <= self.budget: break
+            out.append(m)
+            used -= self.resident[m]
+        return out
+
+    def unload(self, model):
+        try:
+            self.transport.post_json("/api/generate", {"model": model, "keep_alive": 0, "stream": False}, timeout=30)
+        except Exception: return
+        with self.lock:
+            self.resident.pop(model, None)
+            self.stats["unloads"] += 1
+
+    def before_request(self, model):
+        # -> keep_alive to send with this request
+        self.sync()
+        with self.lock:
+            if self.recent:
+                counts = self.transitions.setdefault(self.recent[-1], {})
+                counts[model] = counts.get(model, 0) + 1
+            self.recent.append(model)
+            self.stats["requests"] += 1
+            if model not in self.resident: self.stats["swaps"] += 1
+            elif model in self.prewarmed: self.stats["prewarm_hits"] += 1
+            self.prewarmed.discard(model)
+            victims = self.victims(model, {self.predict_next(model)})
+            keep_alive = self.keep_alive_for(model)
+        for victim in victims: self.unload(victim)
+        with self.lock: self.resident[model] = self.size(model)
+        return keep_alive
+
+    def after_request(self, model, final):
+        load_ns = (final or {}).get("load_duration", 0)
+        with self.lock:
+            if load_ns > 1e8: # >0.1s: the model was actually read from disk
+                self.stats["loads"] += 1
+                self.stats["load_seconds"] += load_ns / 1e9
+            nxt = self.predict_next(model)
+        if self.prewarm_enabled and self.budget and nxt and nxt != model and nxt not in self.resident:
+            threading.Thread(target=self.warm, args=(nxt,), daemon=True).start()
+
+    def warm(self, model):
+        # Load the expert we expect next, making room for it if the budget demands
+        with self.lock:
+            if model in self.resident: return
+            victims = self.victims(model, {self.predict_next(model)})
+            keep_alive = self.keep_alive_for(model)
+            if keep_alive == KEEP_ALIVE["cold"]: keep_alive = KEEP_ALIVE["warm"] # it is expected soon
+        for victim in victims: self.unload(victim)
+        try:
+            self.transport.post_json("/api/generate", {"model": model, "keep_alive": keep_alive, "stream": False}, timeout=120)
+        except Exception: return
+        with self.lock:
+            self.resident[model] = self.size(model)
+            self.prewarmed.add(model)
+            self.stats["prewarms"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, resident=sorted(self.resident), budget_mb=self.budget // 2**20)
+
+class PrewarmTracker:
+    # Did the expert pre-loaded while the user typed match the one the turn used,
+    # and what was time-to-first-token with and without it?
+    def __init__(self, window=200, max_age=120.0, min_interval=5.0):
+        self.max_age = max_age
+        self.min_interval = min_interval
+        self.pending = None # (model, predicted at)
+        self.lock = threading.Lock()
+        self.stats = {"predictions": 0, "hit": 0, "miss": 0, "unprimed": 0}
+        self.ttft = {k: deque(maxlen=window) for k in ("hit", "miss", "unprimed")}
+
+    def predicted(self, model):
+        # -> False if the same expert was just warmed (no need to ask Ollama again)
+        with self.lock:
+            now = time.time()
+            if self.pending and self.pending[0] == model and now - self.pending[1] < self.min_interval: return False
+            self.pending = (model, now)
+            self.stats["predictions"] += 1
+            return True
+
+    def outcome(self, model):
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if not pending or time.time() - pending[1] > self.max_age: result = "unprimed"
+            else: result = "hit" if pending[0] == model else "miss"
+            self.stats[result] += 1
+            return result
+
+    def record_ttft(self, outcome, seconds):
+        with self.lock: self.ttft[outcome].append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.stats)
+            for k, v in self.ttft.items(): out[f"ttft_{k}_ms"] = round(sum(v) / len(v) * 1000, 1) if v else None
+            return out
+
+# ==========================================
+#        RETRIEVAL: ATTACHED FILE CHUNKS
+# ==========================================
+
+class FileIndex:
+    # Attached files are cut into line-aligned chunks and indexed once per (path, mtime, size).
+    # Only byte offsets and a contentless FTS5 index are stored; files are streamed a block at
+    # a time and chunk text is re-read on demand, so multi-hundred-MB logs never sit in memory.
+    # The index lives on disk and survives restarts.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, size INTEGER, chunks INTEGER, used REAL);
+        CREATE TABLE IF NOT EXISTS spans (file_id INTEGER, seq INTEGER, start INTEGER, length INTEGER, PRIMARY KEY (file_id, seq)) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=FILE_INDEX_DB, chunk_bytes=2000, max_files=64, block_bytes=1 << 20):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.max_files = max_files
+        self.block_bytes = block_bytes
+        self.lock = threading.RLock()
+        self._db = None
+        self.has_fts = False
+
+    @property
+    def db(self):
+        with self.lock:
+            if self._db is None:
+                db = sqlite3.connect(ensure_parent(self.path), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(self.SCHEMA)
+                try:
+                    db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts_probe USING fts5(body)")
+                    self.has_fts = True
+                except sqlite3.OperationalError:
+                    pass # SQLite built without FTS5: files are offered from the top
+                self._db = db
+            return self._db
+
+    def close(self):
+        with self.lock:
+            if self._db is not None: self._db.close()
+            self._db = None
+
+    def lookup(self, path, st):
+        row = self.db.execute("SELECT id, mtime_ns, size, chunks FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == st.st_mtime_ns and row[2] == st.st_size: return row[0], row[3]
+        return None
+
+    def fresh(self, path):
+        try:
+            st = os.stat(path)
+        except OSError: return False
+        with self.lock: return self.lookup(os.path.abspath(path), st) is not None
+
+    def split(self, f):
+        # (offset, bytes) chunks of at most chunk_bytes, cut after a newline where possible
+        pos, buf = 0, b""
+        while True:
+            block = f.read(self.block_bytes)
+            buf = buf + block if buf else block
+            i = 0
+            while len(buf) - i >= self.chunk_bytes or (not block and i < len(buf)):
+                end = min(i + self.chunk_bytes, len(buf))
+                if end < len(buf) or block:
+                    nl = buf.rfind(b"\n", i, end)
+                    if nl > i: end = nl + 1
+                yield pos + i, buf[i:end]
+                i = end
+            pos, buf = pos + i, buf[i:]
+            if not block: return
+
+    def drop(self, file_id):
+        self.db.execute(f"DROP TABLE IF EXISTS chunks_{file_id}")
+        self.db.execute("DELETE FROM spans WHERE file_id = ?", (file_id,))
+        self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def ensure(self, path):
+        # -> (file_id, chunk count), indexing the file first if it is new or changed
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError: return None
+        with self.lock:
+            entry = self.lookup(path, st)
+            if entry:
+                with self.db: self.db.execute("UPDATE files SET used = ? WHERE id = ?", (time.time(), entry[0]))
+                return entry
+            try:
+                with open(path, "rb") as f: entry = self.index(path, st, f)
+            except OSError: return None
+            self.evict()
+            return entry
+
+    def index(self, path, st, f):
+        db = self.db
+        with db:
+            old = db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if old: self.drop(old[0])
+            file_id = db.execute("INSERT INTO files (path, mtime_ns, size, chunks, used) VALUES (?, ?, ?, 0, ?)",
+                                 (path, st.st_mtime_ns, st.st_size, time.time())).lastrowid
+            if self.has_fts: db.execute(f"CREATE VIRTUAL TABLE chunks_{file_id} USING fts5(body, content='')")
+            spans, bodies, n = [], [], 0
+            for start, chunk in self.split(f):
+                spans.append((file_id, n, start, len(chunk)))
+                if self.has_fts: bodies.append((n, chunk.decode("utf-8", "ignore")))
+                n += 1
+                if len(spans) >= 1000:
+                    self.flush(file_id, spans, bodies)
+                    spans, bodies = [], []
+            self.flush(file_id, spans, bodies)
+            db.execute("UPDATE files SET chunks = ? WHERE id = ?", (n, file_id))
+        return file_id, n
+
+    def flush(self, file_id, spans, bodies):
+        self.db.executemany("INSERT INTO spans (file_id, seq, start, length) VALUES (?, ?, ?, ?)", spans)
+        if bodies: self.db.executemany(f"INSERT INTO chunks_{file_id} (rowid, body) VALUES (?, ?)", bodies)
+
+    def evict(self):
+        stale = self.db.execute("SELECT id FROM files ORDER BY used DESC LIMIT -1 OFFSET ?", (self.max_files,)).fetchall()
+        if not stale: return
+        with self.db:
+            for (file_id,) in stale: self.drop(file_id)
+
+    def retrieve(self, path, query, k=RETRIEVE_TOP_K):
+        # -> ([(seq, text, bm25 rank)] best match first, total chunks): the top-k chunks for the
+        #    words of `query`, topped up from the start of the file (rank None); None if it
+        #    can't be read. Lower ranks are better; each file is scored by its own index.
+        entry = self.ensure(path)
+        if entry is None: return None
+        file_id, total = entry
+        ranks = {}
+        with self.lock:
+            words = {w for w in re.findall(r"\w+", query.lower()) if len(w) > 1}
+            if self.has_fts and words:
+                match = " OR ".join(f'"{w}"' for w in words)
+                ranks = dict(self.db.execute(
+                    f"SELECT rowid, rank FROM chunks_{file_id} WHERE chunks_{file_id} MATCH ? ORDER BY rank LIMIT ?", (match, k)))
+            seqs = list(ranks)
+            for seq in range(total):
+                if len(seqs) >= k: break
+                if seq not in seqs: seqs.append(seq)
+            marks = ",".join("?" * len(seqs))
+            spans = dict((seq, (start, length)) for seq, start, length in self.db.execute(
+                f"SELECT seq, start, length FROM spans WHERE file_id = ? AND seq IN ({marks})", [file_id] + seqs))
+        out = []
+        try:
+            with open(os.path.abspath(path), "rb") as f:
+                for seq in seqs:
+                    f.seek(spans[seq][0])
+                    out.append((seq, f.read(spans[seq][1]).decode("utf-8", "ignore"), ranks.get(seq)))
+        except (OSError, KeyError): return None
+        return out, total
+
+# ==========================================
+#        VISION: IMAGE PAYLOAD CACHE
+# ==========================================
+
+_DIGESTS = OrderedDict() # (path, mtime, size) -> sha256 of the contents
+_DIGEST_LOCK = threading.Lock()
+
+def file_digest(path, st=None):
+    st = st or os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _DIGEST_LOCK:
+        if key in _DIGESTS: return _DIGESTS[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    with _DIGEST_LOCK:
+        _DIGESTS[key] = h.hexdigest()
+        while len(_DIGESTS) > 1024: _DIGESTS.popitem(last=False)
+    return h.hexdigest()
+
+class ImageCache:
+    # base64 payloads keyed by (sha256 of the file, max side): re-sending, re-attaching or
+    # renaming an image costs a stat() instead of a read + resize + encode. Bounded LRU by size.
+    def __init__(self, max_side=IMAGE_MAX_SIDE, max_bytes=IMAGE_CACHE_MB * 2**20, quality=85):
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.payloads = OrderedDict() # (sha256, max side) -> (base64, raw bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "raw_bytes": 0, "sent_bytes": 0}
+
+    def shrink(self, data):
+        # JPEG no larger than max_side on its longest side; the original if that isn't smaller
+        if not HAS_PIL or not self.max_side: return data
+        try:
+            from PIL import Image, ImageOps
+            with Image.open(io.BytesIO(data)) as img:
+                if max(img.size) <= self.max_side and len(data) <= 2**20: return data
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.max_side, self.max_side))
+                if img.mode != "RGB": img = img.convert("RGB")
+                out = io.BytesIO()
+                img.save(out, "JPEG", quality=self.quality)
+        except Exception:
+            return data # not something Pillow can read: let the model try
+        return out.getvalue() if out.tell() < len(data) else data
+
+    def encode(self, path):
+        # -> (base64 payload, bytes on disk, cache hit)
+        st = os.stat(path)
+        key = (file_digest(path, st), self.max_side)
+        with self.lock:
+            if key in self.payloads:
+                self.payloads.move_to_end(key)
+                payload = self.payloads[key][0]
+                self.stats["hits"] += 1
+                self.stats["raw_bytes"] += st.st_size
+                self.stats["sent_bytes"] += len(payload)
+                return payload, st.st_size, True
+        with open(path, "rb") as f: data = f.read()
+        payload = base64.b64encode(self.shrink(data)).decode('ascii')
+        with self.lock:
+            if key not in self.payloads:
+                self.payloads[key] = (payload, len(data))
+                self.size += len(payload)
+            while self.size > self.max_bytes and len(self.payloads) > 1:
+                self.size -= len(self.payloads.popitem(last=False)[1][0])
+            self.stats["misses"] += 1
+            self.stats["raw_bytes"] += len(data)
+            self.stats["sent_bytes"] += len(payload)
+        return payload, len(data), False
+
+# ==========================================
+#        CONTEXT: TOKEN-BUDGETED PROMPT
+# ==========================================
+
+# Ollama silently drops the front of a prompt longer than num_ctx (persona included),
+# so requests are packed to a token budget rather than "last 10 messages, 2000 chars per file"
+TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w{1,4}|[^\w\s]")
+MSG_OVERHEAD = 4 # role markers and separators per chat message
+SKIP_FILES = ('.png', '.jpg', '.jpeg', '.gif', '.exe', '.zip')
+TRUNCATED_COST = 10 # "... [Truncated]" marker, charged up front per file
+GAP_COST = 5 # "[...]" between chunks that are not adjacent in the file
+
+class TokenCounter:
+    # Deliberately pessimistic BPE estimate: one token per 4 word characters, per CJK
+    # character and per punctuation mark. Cached, since history is re-counted every turn;
+    # keyed on (hash, length) rather than the text, so cached entries keep no text alive.
+    def __init__(self, max_entries=16384):
+        self.max_entries = max_entries
+        self.counts = OrderedDict() # (hash, length) -> estimate
+        self.lock = threading.Lock()
+
+    def __call__(self, text):
+        key = (hash(text), len(text))
+        with self.lock:
+            n = self.counts.get(key)
+            if n is not None:
+                self.counts.move_to_end(key)
+                return n
+        n = len(TOKEN_RE.findall(text))
+        with self.lock:
+            self.counts[key] = n
+            if len(self.counts) > self.max_entries: self.counts.popitem(last=False)
+        return n
+
+    def cache_clear(self):
+        with self.lock: self.counts.clear()
+
+count_tokens = TokenCounter()
+
+class ContextBuilder:
+    # Priority: persona + prompt (always), user facts (up to memory_share of the budget),
+    # attached files (up to file_share of what is left), history newest-first in whole
+    # turns, and whatever history doesn't use goes back to the files.
+    def __init__(self, budget=NUM_CTX - REPLY_TOKENS, memory_share=0.15, file_share=0.5,
+                 layout=PROMPT_LAYOUT, index=None, top_k=RETRIEVE_TOP_K):
+        self.budget = budget
+        self.layout = layout
+        self.memory_share = memory_share
+        self.file_share = file_share
+        self.index = index or FileIndex()
+        self.top_k = top_k
+
+    def fit_history(self, history, room):
+        # -> (start, tokens): newest-first whole messages, never opening on an assistant reply
+        start, used = len(history), 0
+        for i in range(len(history) - 1, -1, -1):
+            cost = count_tokens(history[i]["content"]) + MSG_OVERHEAD
+            if used + cost > room: break
+            used += cost
+            start = i
+        while start < len(history) and history[start]["role"] != "user":
+            used -= count_tokens(history[start]["content"]) + MSG_OVERHEAD
+            start += 1
+        return start, used
+
+    def build(self, persona, facts, attached_files, history, prompt, anchor=0):
+        # -> (messages, report); the user message is last so images can be attached to it.
+        # "stable" layout: persona, facts and history form a prefix that only grows between
+        # turns, so Ollama can reuse its KV cache; time and files ride in the final message.
+        # "legacy": everything in the system message, as before.
+        stable = self.layout == "stable"
+        static = [f"OS: {os.name} ({sys.platform})"]
+        volatile = [f"Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"]
+        budget = self.budget
+        used = (count_tokens(persona) + count_tokens("\n".join(static + volatile)) + count_tokens(prompt)
+                + count_tokens("CONTEXT:\nCONTEXT:\nUser Facts:") + 2 * MSG_OVERHEAD)
+        report = {"budget": budget, "layout": self.layout}
+
+        # 1. user facts, in the order they were remembered
+        lines, cap = [], used + budget * self.memory_share
+        for fact in facts:
+            line = f"- {fact}"
+            cost = count_tokens(line)
+            if used + cost > min(cap, budget): break
+            lines.append(line)
+            used += cost
+        report["facts"], report["facts_dropped"] = len(lines), len(facts) - len(lines)
+
+        # 2. attached files: [title, [(seq, text)] kept, total]. The chunks of all files compete
+        #    in one list, so attachment order doesn't decide what gets in: matches by bm25
+        #    rank, then the rest taking turns between files. A chunk that doesn't fit is
+        #    skipped, not the end of packing: a smaller one further down still may.
+        files, candidates = [], [] # candidates: [sort key, file, seq, text, taken]
+        for path in attached_files:
+            if path.lower().endswith(SKIP_FILES) or not os.path.isfile(path): continue
+            entry = self.index.retrieve(path, prompt, self.top_k)
+            if not entry: continue
+            for pos, (seq, text, rank) in enumerate(entry[0]):
+                candidates.append([(rank is None, pos if rank is None else rank, len(files)), len(files), seq, text, False])
+            files.append([f"--- FILE: {os.path.basename(path)} ---", [], entry[1]])
+        candidates.sort(key=lambda c: c[0])
+
+        def add_files(limit):
+            nonlocal used
+            for c in candidates:
+                if c[4]: continue
+                title, kept = files[c[1]][0], files[c[1]][1]
+                cost = count_tokens(c[3]) + GAP_COST + (0 if kept else count_tokens(title) + TRUNCATED_COST)
+                if used + cost > limit: continue
+                used += cost
+                kept.append((c[2], c[3]))
+                c[4] = True
+        add_files(used + max(0, budget - used) * self.file_share)
+
+        # 3. history. The stable layout keeps last turn's first message while everything after
+        #    it still fits; once it doesn't, it re-anchors at half the room so the following
+        #    turns can grow into the other half without moving the prefix again.
+        start = None
+        if stable and anchor <= len(history):
+            start, cost = anchor, 0
+            for m in itertools.islice(history, anchor, None):
+                cost += count_tokens(m["content"]) + MSG_OVERHEAD
+                if used + cost > budget:
+                    start, cost = self.fit_history(history, (budget - used) // 2)
+                    break
+        if start is None: start, cost = self.fit_history(history, budget - used)
+        used += cost
+        report["history"], report["history_dropped"], report["start"] = len(history) - start, start, start
+
+        # 4. room the history didn't need goes back to the files
+        add_files(budget)
+        for title, kept, total in files:
+            if not kept: continue
+            # kept chunks in file order, with a marker wherever part of the file was left out
+            body, last = "", -1
+            for seq, text in sorted(kept):
+                if seq != last + 1: body += "\n[...]\n"
+                body += text
+                last = seq
+            if len(kept) < total: body += "... [Truncated]"
+            volatile.append(f"{title}\n{body}")
+        if lines: static.append("User Facts:\n" + "\n".join(lines))
+        report["file_chunks"] = sum(len(f[1]) for f in files)
+        report["file_chunks_dropped"] = sum(f[2] - len(f[1]) for f in files)
+        report["used"] = used
+
+        if stable:
+            msgs = [{"role": "system", "content": f"{persona}\nCONTEXT:\n" + "\n".join(static)}]
+            msgs += history[start:]
+            msgs.append({"role": "user", "content": "CONTEXT:\n" + "\n".join(volatile) + "\n\n" + prompt})
+        else:
+            msgs = [{"role": "system", "content": f"{persona}\nCONTEXT:\n" + "\n".join(volatile[:1] + static + volatile[1:])}]
+            msgs += history[start:]
+            msgs.append({"role": "user", "content": prompt})
+        return msgs, report
+
+class PromptEvalStats:
+    # Ollama's final chunk says how many prompt tokens it actually evaluated and how long
+    # that took; tokens served from a reused KV-cache prefix are not counted
+    def __init__(self, window=200):
+        self.turns = deque(maxlen=window)
+        self.last = None
+        self.lock = threading.Lock()
+
+    def record(self, model, context, final):
+        if not final or "prompt_eval_duration" not in final: return None
+        entry = {"model": model, "layout": context["layout"], "packed": context["used"],
+                 "evaluated": final.get("prompt_eval_count", 0), "ms": final["prompt_eval_duration"] / 1e6}
+        with self.lock:
+            self.turns.append(entry)
+            self.last = entry
+        return entry
+
+    def snapshot(self):
+        with self.lock: turns = list(self.turns)
+        out = {}
+        for layout in sorted({t["layout"] for t in turns}):
+            group = [t for t in turns if t["layout"] == layout]
+            out[layout] = {"turns": len(group),
+                           "prompt_eval_ms": round(sum(t["ms"] for t in group) / len(group), 1),
+                           "evaluated_tokens": round(sum(t["evaluated"] for t in group) / len(group)),
+                           "packed_tokens": round(sum(t["packed"] for t in group) / len(group))}
+        return out
+
+# ==========================================
+#        CACHE: RESPONSE REPLAY
+# ==========================================
+
+class ResponseCache:
+    # Answers to standalone questions (the first turn of a chat) keyed on (routed model,
+    # normalized prompt, memory, attached file contents). With `similarity` and an embedder, a prompt
+    # whose embedding is that close to a cached one in the same model/context also hits.
+    # Entries expire after `ttl`; least recently used answers go once they exceed `max_bytes`.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, model TEXT, scope TEXT, prompt TEXT, answer TEXT, has_cmd INTEGER,
+            seconds REAL, created REAL, used REAL, hits INTEGER DEFAULT 0, vector BLOB);
+        CREATE INDEX IF NOT EXISTS responses_by_use ON responses(used);
+        CREATE INDEX IF NOT EXISTS responses_by_scope ON responses(model, scope, used);
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_DB, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MB * 2**20,
+                 similarity=RESPONSE_CACHE_SIMILARITY, embed=None, max_candidates=500):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.similarity = similarity
+        self.embed = embed if similarity > 0 else None
+        self.max_candidates = max_candidates
+        self.lock = threading.RLock()
+        self._db = None
+        self.stats = {"lookups": 0, "hits": 0, "near_hits": 0, "stores": 0, "saved_seconds": 0.0, "lookup_seconds": 0.0}
+
+    @property
+    def db(self):
+        with self.lock:
+            if self._db is None:
+                db = sqlite3.connect(ensure_parent(self.path), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(self.SCHEMA)
+                self._db = db
+            return self._db
+
+    def close(self):
+        with self.lock:
+            if self._db is not None: self._db.close()
+            self._db = None
+
+    @staticmethod
+    def normalize(prompt):
+        # Case and whitespace only: "2+2" and "2-2" must not share an answer (fuzzy matching
+        # is the opt-in embedding path's job)
+        return " ".join(prompt.lower().split())
+
+    def scope(self, facts, attached_files):
+        # Digest of everything besides the prompt that shapes the answer
+        h = hashlib.sha256("\n".join(facts).encode("utf-8"))
+        for path in attached_files:
+            try:
+                h.update(file_digest(path).encode())
+            except OSError:
+                h.update(path.encode("utf-8", "ignore"))
+        return h.hexdigest()
+
+    def key(self, model, prompt, scope):
+        return hashlib.sha256(json.dumps([model, self.normalize(prompt), scope]).encode("utf-8")).hexdigest()
+
+    def vector(self, prompt):
+        if not self.embed: return None
+        try:
+            return normalize(self.embed(prompt))
+        except Exception:
+            return None # embedder down: exact matches still work
+
+    def get(self, model, prompt, scope):
+        # -> {"answer", "has_cmd", "seconds", "match"} or None
+        t0 = time.perf_counter()
+        now = time.time()
+        hit, match = None, "exact"
+        with self.lock:
+            self.stats["lookups"] += 1
+            row = self.db.execute("SELECT key, answer, has_cmd, seconds FROM responses WHERE key = ? AND created > ?",
+                                  (self.key(model, prompt, scope), now - self.ttl)).fetchone()
+        if row is None and self.embed:
+            vec = self.vector(prompt)
+            if vec is not None:
+                with self.lock:
+                    rows = self.db.execute(
+                        "SELECT key, answer, has_cmd, seconds, vector FROM responses WHERE model = ? AND scope = ? AND created > ? "
+                        "AND vector IS NOT NULL ORDER BY used DESC LIMIT ?", (model, scope, now - self.ttl, self.max_candidates)).fetchall()
+                best = 0.0
+                for r in rows:
+                    score = sum(a * b for a, b in zip(vec, array.array("f", r[4])))
+                    if score >= self.similarity and score > best: best, row = score, r[:4]
+                match = "near"
+        if row is not None:
+            with self.lock, self.db:
+                self.db.execute("UPDATE responses SET used = ?, hits = hits + 1 WHERE key = ?", (now, row[0]))
+            hit = {"answer": row[1], "has_cmd": bool(row[2]), "seconds": row[3], "match": match}
+        with self.lock:
+            if hit:
+                self.stats["hits"] += 1
+                self.stats["near_hits"] += match == "near"
+                self.stats["saved_seconds"] += hit["seconds"]
+            self.stats["lookup_seconds"] += time.perf_counter() - t0
+        return hit
+
+    def put(self, model, prompt, scope, answer, has_cmd, seconds):
+        if not answer: return
+        vec = self.vector(prompt)
+        blob = array.array("f", vec).tobytes() if vec is not None else None
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, model, scope, prompt, answer, has_cmd, seconds, created, used, vector) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (self.key(model, prompt, scope), model, scope, prompt, answer, int(has_cmd), seconds, now, now, blob))
+            self.stats["stores"] += 1
+            self.evict(now)
+
+    def evict(self, now):
+        self.db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        total = self.db.execute("SELECT COALESCE(SUM(LENGTH(answer) + LENGTH(prompt) + COALESCE(LENGTH(vector), 0)), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes: return
+        for key, size in self.db.execute("SELECT key, LENGTH(answer) + LENGTH(prompt) + COALESCE(LENGTH(vector), 0) FROM responses ORDER BY used").fetchall():
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes: break
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.stats)
+            out["hit_rate"] = round(out["hits"] / out["lookups"], 3) if out["lookups"] else None
+            out["entries"] = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return out
+
+# ==========================================
+#        TELEMETRY: PER-REQUEST METRICS
+# ==========================================
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+class Trace:
+    # Stage timings of one request, in seconds; a stage entered twice accumulates
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.spans = {}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+class Telemetry:
+    # Every request becomes one JSON line: stage spans, TTFT and Ollama's own counters from the
+    # final chunk. The file rotates at `max_bytes` (metrics.jsonl.1 .. .backups), and the last
+    # `window` records per model back the p50/p95 figures of snapshot().
+    STATS = ("total_ms", "ttft_ms", "tokens_per_s", "prompt_eval_ms", "save_ms")
+
+    def __init__(self, path=METRICS_FILE, enabled=METRICS, max_bytes=METRICS_MAX_MB * 2**20, backups=3, window=500):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.window = window
+        self.size = None
+        self.models = {} # model -> deque of records
+        self.profile_armed = PROFILE_NEXT
+        self.lock = threading.Lock()
+
+    def record(self, trace, **fields):
+        # Ollama reports durations in nanoseconds
+        final = fields.pop("final", None) or {}
+        rec = {"time": round(time.time(), 3), **fields}
+        rec["total_ms"] = round((time.perf_counter() - trace.started) * 1000, 2)
+        rec["spans_ms"] = {k: round(v * 1000, 2) for k, v in trace.spans.items()}
+        if "ttft" in trace.spans: rec["ttft_ms"] = rec["spans_ms"].pop("ttft")
+        for key in ("eval_count", "prompt_eval_count"):
+            if key in final: rec[key] = final[key]
+        for key in ("eval_duration", "prompt_eval_duration", "load_duration", "total_duration"):
+            if key in final: rec[key.replace("duration", "ms")] = round(final[key] / 1e6, 2)
+        if final.get("eval_count") and final.get("eval_duration"):
+            rec["tokens_per_s"] = round(final["eval_count"] / (final["eval_duration"] / 1e9), 1)
+        rec["save_ms"] = rec["spans_ms"].get("save")
+        with self.lock:
+            self.models.setdefault(rec.get("model"), deque(maxlen=self.window)).append(rec)
+            if self.enabled: self.write(rec)
+        return rec
+
+    def write(self, rec):
+        line = (json.dumps(rec) + "\n").encode("utf-8")
+        try:
+            if self.size is None: # first write since startup
+                self.size = os.path.getsize(self.path) if os.path.exists(ensure_parent(self.path)) else 0
+            if self.size + len(line) > self.max_bytes: self.rotate()
+            with open(self.path, "ab") as f: f.write(line)
+            self.size += len(line)
+        except OSError:
+            pass # metrics must never break a chat
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"): os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if os.path.exists(self.path): os.replace(self.path, f"{self.path}.1")
+        self.size = 0
+
+    def snapshot(self):
+        # -> {model: {"requests": n, "<stat>_p50": .., "<stat>_p95": ..}}
+        with self.lock: models = {m: list(recs) for m, recs in self.models.items()}
+        out = {}
+        for model, recs in models.items():
+            stats = {"requests": len(recs)}
+            for key in self.STATS:
+                values = [r[key] for r in recs if r.get(key) is not None]
+                stats[f"{key}_p50"], stats[f"{key}_p95"] = percentile(values, 0.5), percentile(values, 0.95)
+            out[model] = stats
+        return out
+
+    def profile_next(self):
+        with self.lock: self.profile_armed = True
+
+    @contextlib.contextmanager
+    def profiled(self):
+        # cProfile around one request when armed (yields whether it is); the .prof path and
+        # the top functions by cumulative time go to the metrics file
+        with self.lock: armed, self.profile_armed = self.profile_armed, False
+        if not armed:
+            yield False
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield True
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"request_{int(time.time() * 1000)}.prof")
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            with self.lock: self.write({"time": round(time.time(), 3), "kind": "profile", "path": path, "top": out.getvalue()})
+
+# ==========================================
+#        COMMANDS: APPROVED EXECUTION
+# ==========================================
+
+class CommandRunner:
+    # Approved commands run on a bounded pool (one child process per worker thread), never on
+    # the caller's thread. Output goes to `on_output` as it is produced; the pieces joined are
+    # exactly the returned result. Idempotent read-only commands are answered from a short cache.
+    FORBIDDEN_CHARS = [";", "&", "|", ">", "<", "`", "$", "\n", "\r"]
+    ALLOWED_COMMANDS = [
+        "ipconfig", "ifconfig", "ip", # Network
+        "dir", "ls",                  # File System
+        "ping", "netstat",            # Utilities
+        "systeminfo", "whoami",       # Info
+        "echo", "date", "time"        # Basics
+    ]
+    # Exact invocations (not base commands: `ipconfig /renew`, `ip link set ...` change state)
+    # that give the same answer for a while, so they are cacheable
+    READ_ONLY = {"whoami", "systeminfo", "ipconfig", "ipconfig /all", "ip addr", "ip a"}
+
+    def __init__(self, workers=COMMAND_WORKERS, timeout=COMMAND_TIMEOUT, ttl=COMMAND_CACHE_TTL, max_entries=64):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moe-command")
+        self.timeout, self.ttl, self.max_entries = timeout, ttl, max_entries
+        self.cache = OrderedDict() # normalized command -> (expires, result)
+        self.lock = threading.Lock()
+        self.stats = {"runs": 0, "cache_hits": 0, "blocked": 0, "timeouts": 0}
+
+    # [FINAL SECURITY CHECK]
+    def check(self, cmd):
+        # -> error message, or None if the command may run
+        if not cmd or not cmd.strip():
+            return "Error: No command provided."
+
+        # 1. Block Shell Operators & Newlines to prevent "Command Injection"
+        #    Blocks: chaining (; & |), redirection (> <), subshells (` $), and multiline attacks (\n \r)
+        if any(char in cmd for char in self.FORBIDDEN_CHARS):
+            return "Blocked: Special characters and command chaining are disabled for security."
+
+        # 2. Strict Whitelist (Cross-Platform)
+        # Extract the base command (e.g., 'ping' from 'ping google.com')
+        base_cmd = cmd.strip().split()[0].lower()
+        if base_cmd not in self.ALLOWED_COMMANDS:
+            return f"Blocked: '{base_cmd}' is not in the authorized whitelist."
+        return None
+
+    def cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.stats["cache_hits"] += 1
+                return entry[1]
+            self.cache.pop(key, None)
+            return None
+
+    def submit(self, cmd, on_output=None):
+        # -> Future with the full result ("Output:\n..." / "Blocked: ..." / "Error: ...")
+        emit = on_output or (lambda text: None)
+        return self.pool.submit(self.run_now, cmd, emit)
+
+    def run(self, cmd, on_output=None):
+        return self.submit(cmd, on_output).result()
+
+    def run_now(self, cmd, emit):
+        problem = self.check(cmd)
+        if problem:
+            with self.lock: self.stats["blocked"] += 1
+            emit(problem)
+            return problem
+        key = " ".join(cmd.split())
+        readonly = self.ttl > 0 and key.lower() in self.READ_ONLY
+        hit = self.cached(key) if readonly else None
+        if hit is not None:
+            emit(hit)
+            return hit
+
+        with self.lock: self.stats["runs"] += 1
+        try:
+            # shell=True is safe here ONLY because we filtered operators above.
+            # It is required for 'dir' on Windows.
+            # Own process group, so a timeout takes the shell's children down with it
+            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                    start_new_session=os.name != "nt")
+        except Exception as e:
+            emit(f"Error: {str(e)}")
+            return f"Error: {str(e)}"
+        timed_out = threading.Event()
+        timer = threading.Timer(self.timeout, lambda: (timed_out.set(), self.kill(proc)))
+        timer.start()
+        parts = ["Output:\n"]
+        emit(parts[0])
+        try:
+            with proc.stdout:
+                for line in proc.stdout:
+                    parts.append(line.decode('utf-8', errors='ignore'))
+                    emit(parts[-1])
+            proc.wait()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            with self.lock: self.stats["timeouts"] += 1
+            parts.append("\nError: Command timed out.")
+            emit(parts[-1])
+        result = "".join(parts)
+        if readonly and proc.returncode == 0:
+            with self.lock:
+                self.cache[key] = (time.monotonic() + self.ttl, result)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_entries: self.cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def kill(proc):
+        try:
+            if os.name == "nt":
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except (OSError, subprocess.SubprocessError):
+            proc.kill()
+
+    def shutdown(self, wait=False):
+        self.pool.shutdown(wait=wait)
+
+# ==========================================
+#        BACKEND: INTELLIGENCE & SAFETY
+# ==========================================
+
+class TagStreamFilter:
+    # One pass over the stream: <think> blocks go to `reasoning`, everything else to
+    # `visible`, and each closed <cmd>...</cmd> lands in `commands`. Only a possible
+    # partial tag at the end of a chunk (at most 7 chars) is held back for the next one.
+    TAGS = {"text": ("<think>", "<cmd>"), "think": ("</think>",), "cmd": ("</cmd>",)}
+
+    def __init__(self):
+        self.state = "text"
+        self.pending = ""
+        self.visible, self.reasoning, self.commands, self.cmd_parts = [], [], [], []
+
+    @property
+    def text(self): return "".join(self.visible)
+
+    @property
+    def thinking(self): return "".join(self.reasoning)
+
+    def route(self, segment, events):
+        if not segment: return
+        if self.state == "think":
+            self.reasoning.append(segment)
+            events.append(("reasoning", segment))
+            return
+        if self.state == "cmd": self.cmd_parts.append(segment)
+        self.visible.append(segment)
+        if events and events[-1][0] == "text": events[-1] = ("text", events[-1][1] + segment)
+        else: events.append(("text", segment))
+
+    def feed(self, text):
+        events = []
+        if not self.pending and "<" not in text:
+            self.route(text, events)
+            return events
+        s = self.pending + text
+        self.pending = ""
+        start = i = 0
+        tags = self.TAGS[self.state]
+        end = len(s)
+        while True:
+            j = s.find("<", i)
+            if j == -1: break
+            tag = next((t for t in tags if s.startswith(t, j)), None)
+            if tag is None:
+                rest = s[j:]
+                if len(rest) < 8 and any(t.startswith(rest) for t in tags):
+                    self.pending, end = rest, j
+                    break
+                i = j + 1
+                continue
+
+            self.route(s[start:j], events)
+            if tag == "<think>":
+                self.state = "think"
+                events.append(("think_start", None))
+            elif tag == "</think>":
+                self.state = "text"
+                events.append(("think_end", None))
+            elif tag == "<cmd>":
+                self.route(tag, events)
+                self.state, self.cmd_parts = "cmd", []
+            else:
+                self.state = "text"
+                self.route(tag, events)
+                self.commands.append("".join(self.cmd_parts).strip())
+                events.append(("command", self.commands[-1]))
+            start = i = j + len(tag)
+            tags = self.TAGS[self.state]
+
+        self.route(s[start:end], events)
+        return events
+
+    def flush(self):
+        events = []
+        self.route(self.pending, events)
+        self.pending = ""
+        return events
+
+class StreamDecoder:
+    # Turns Ollama's NDJSON lines into "stream"/"status" events, hiding <think> blocks
+    def __init__(self, emit):
+        self.emit = emit
+        self.filter = TagStreamFilter()
+        self.final = None # last NDJSON object (done=true): eval/load durations and counts
+        self.first_token_at = None
+        self.think_started = None
+        self.think_seconds = 0.0
+
+    def feed(self, line):
+        if not line.strip(): return
+        try:
+            chunk = json.loads(line.decode())
+        except json.JSONDecodeError: return
+        if chunk.get("done"): self.final = chunk
+        self.dispatch(self.filter.feed(chunk.get('message', {}).get('content', '')))
+
+    def close(self):
+        self.dispatch(self.filter.flush())
+
+    def dispatch(self, events):
+        for kind, data in events:
+            if kind == "text":
+                if self.first_token_at is None: self.first_token_at = time.perf_counter()
+                self.emit("stream", data)
+            elif kind == "think_start":
+                self.think_started = time.perf_counter()
+                self.emit("status", "Thinking... (Hiding Output)")
+            elif kind == "think_end":
+                if self.think_started: self.think_seconds += time.perf_counter() - self.think_started
+                self.think_started = None
+                self.emit("status", "Answering...")
+
+_ISSUED_IDS = set()
+_ID_LOCK = threading.Lock()
+
+def new_chat_id(taken=None):
+    # chat_<unix time>, suffixed when several sessions open within the same second
+    base = f"chat_{int(time.time())}"
+    with _ID_LOCK:
+        chat_id, n = base, 1
+        while chat_id in _ISSUED_IDS or (taken and taken(chat_id)):
+            n += 1
+            chat_id = f"{base}_{n}"
+        _ISSUED_IDS.add(chat_id)
+    return chat_id
+
+class ChatSession:
+    # Everything that belongs to one conversation: its history, chat file and STOP token.
+    # `history` is the newest part of the chat; the `offset` messages before it are on disk.
+    def __init__(self, chat_id=None, history=None, offset=0, persist=True):
+        self.chat_id = chat_id or new_chat_id()
+        self.history = history if history is not None else []
+        self.offset = offset
+        self.persist = persist # False: history supplied by an API client, never written to the store
+        self.model = None # expert that answered the last turn
+        self.persisted = len(self.history) # history[persisted:] is not in the store yet
+        self.context_start = 0 # first history message of the last prompt (stable-prefix anchor)
+        self.pending = 0 # turns queued or running on a SessionEngine
+        self.cancel = threading.Event()
+        self.lock = threading.Lock()
+
+SYSTEM_PERSONA = (
+    "You are a helpful desktop assistant. "
+    "GUIDELINES:\n"
+    "1. For greetings ('hello') or general questions, answer NORMALLY in plain text. "
+    "2. ONLY use <cmd>...</cmd> tags if the user specifically asks for a system task "
+    "(like checking network, listing files, or running a script). "
+    "\n"
+    "Example 1: User 'Hi' -> You: 'Hello! How can I help?'\n"
+    "Example 2: User 'Check IP' -> You: '<cmd>ipconfig</cmd>'"
+)
+
+class AIBackend:
+    def __init__(self, transport=None, atransport=None, store=None, router=None):
+        self.transport = transport or OllamaTransport()
+        self.router = router or make_router(self.transport)
+        self.residency = ResidencyManager(self.transport)
+        self.prewarm_tracker = PrewarmTracker()
+        self.context = ContextBuilder()
+        self.prompt_eval = PromptEvalStats()
+        self.images = ImageCache()
+        self.telemetry = Telemetry()
+        self.commands = CommandRunner()
+        self.gc_mode = GC_MODE
+        self.history_keep = HISTORY_KEEP
+        self.responses = None
+        if RESPONSE_CACHE:
+            embed = getattr(self.router, "embed", None) or (lambda p: OllamaEmbedder(self.transport)([p])[0])
+            self.responses = ResponseCache(embed=embed)
+        self.atransport = atransport or AsyncOllamaTransport(self.transport.base_url)
+        self.store = store or ChatStore()
+        self.memory = self.load_json(MEMORY_FILE, default={})
+        self.memory_lock = threading.Lock()
+        self._session = None
+
+    # The GUI drives a single "current" session through these. It is created on first use:
+    # picking a fresh chat id needs the chat database, which startup shouldn't wait for.
+    @property
+    def session(self):
+        if self._session is None: self._session = self.new_session()
+        return self._session
+    @session.setter
+    def session(self, value): self._session = value
+
+    @property
+    def history(self): return self.session.history
+    @history.setter
+    def history(self, value): self.session.history = value
+
+    @property
+    def current_chat_id(self): return self.session.chat_id
+    @current_chat_id.setter
+    def current_chat_id(self, value): self.session.chat_id = value
+
+    @property
+    def stop_signal(self): return self.session.cancel.is_set()
+
+    def load_json(self, path, default):
+        if os.path.exists(path) and os.path.isfile(path):
+            try:
+                with open(path, "r", encoding='utf-8') as f: return json.load(f)
+            except: return default
+        return default
+
+    def save_memory(self):
+        with self.memory_lock:
+            with open(ensure_parent(MEMORY_FILE), "w", encoding='utf-8') as f: json.dump(self.memory, f)
+
+    def new_session(self):
+        return ChatSession(new_chat_id(self.store.exists))
+
+    def save_chat_history(self, session=None):
+        session = session or self.session
+        if not session.persist: return
+        self.store.append(session.chat_id, session.history[session.persisted:])
+        session.persisted = len(session.history)
+        self.trim_history(session)
+
+    def trim_history(self, session):
+        # Forget saved messages beyond history_keep (in batches, and never the ones the last
+        # prompt started from, so the stable prefix doesn't move); load_older() brings them back
+        keep = self.history_keep
+        if not keep or len(session.history) < keep + keep // 2: return
+        drop = min(len(session.history) - keep, session.persisted, session.context_start)
+        if drop <= 0: return
+        del session.history[:drop]
+        session.offset += drop
+        session.persisted -= drop
+        session.context_start -= drop
+
+    def load_older(self, session, limit=HISTORY_PAGE):
+        # -> number of messages reloaded from disk in front of session.history
+        if not session.offset: return 0
+        older = self.store.load(session.chat_id, limit=limit, before=session.offset)
+        session.history[:0] = older
+        session.offset -= len(older)
+        session.persisted += len(older)
+        session.context_start += len(older)
+        return len(older)
+
+    def load_session(self, chat_id, limit=HISTORY_PAGE):
+        chat_id = chat_id.replace(".json", "")
+        history = self.store.load(chat_id, limit=limit)
+        return ChatSession(chat_id, history, offset=max(0, self.store.count(chat_id) - len(history)))
+
+    def load_chat_history(self, chat_id):
+        self.session = self.load_session(chat_id)
+        return self.history
+
+    def get_chat_list(self, limit=None, offset=0):
+        return self.store.list_chats(limit, offset)
+
+    def search_chats(self, query, limit=20):
+        return self.store.search(query, limit)
+    
+    def delete_chat(self, chat_id):
+        try:
+            return self.store.delete(chat_id.replace(".json", ""))
+        except sqlite3.Error:
+            return False
+
+    def stop_generation(self, session=None):
+        (session or self.session).cancel.set()
+
+    # Blocking; the GUI uses self.commands.submit() so nothing runs on the Tk thread
+    def execute_command(self, cmd):
+        return self.commands.run(cmd)
+
+    def run_slash_command(self, p_clean):
+        response_text = ""
+        if p_clean.startswith("/remember"):
+            with self.memory_lock: self.memory[str(len(self.memory)+1)] = p_clean.replace("/remember","").strip()
+            self.save_memory()
+            response_text = "Memory Saved."
+        elif p_clean.startswith("/forget"):
+            self.memory = {}
+            self.save_memory()
+            response_text = "Memory Wiped."
+        elif p_clean.startswith("/profile"):
+            self.telemetry.profile_next()
+            response_text = f"The next request will be profiled into {PROFILE_DIR}."
+        return response_text
+
+    def choose_model(self, prompt, attached_files, force_logic):
+        # --- ROUTER LOGIC ---
+        has_image = any(f.lower().endswith(IMAGE_FILES) for f in attached_files)
+
+        # Priority Chain: Force Logic > Image Present > Router (semantic, else keywords) > Default Chat
+        if force_logic:
+            return MODELS["logic"], None
+        elif has_image:
+            return MODELS["vision"], None
+        route = self.router.route(prompt)
+        return MODELS[route[0]], route
+
+    # Called (debounced) while the user is still typing: route the partial prompt and
+    # load that expert now, so the real request doesn't wait for the model load.
+    def prewarm(self, partial_prompt, attached_files=(), force_logic=False):
+        p_clean = partial_prompt.strip()
+        if not p_clean or p_clean.startswith("/"): return
+        threading.Thread(target=self._prewarm, args=(p_clean, list(attached_files), force_logic), daemon=True).start()
+
+    def _prewarm(self, partial_prompt, attached_files, force_logic):
+        model, _ = self.choose_model(partial_prompt, attached_files, force_logic)
+        if not self.prewarm_tracker.predicted(model): return
+        self.residency.sync(force=True) # our bookkeeping may not know Ollama evicted it
+        self.residency.warm(model)
+
+    def prepare_turn(self, prompt, attached_files, force_logic, session, emit):
+        started = time.perf_counter()
+        trace = Trace(started)
+        if self.gc_mode == "always":
+            with trace.span("gc"): gc.collect()
+        with trace.span("route"): model, route = self.choose_model(prompt, attached_files, force_logic)
+        session.model = model
+        with self.memory_lock: facts = list(self.memory.values())
+
+        # Only a chat's first question is standalone: a follow-up ("why?", "continue") means
+        # something different in every conversation, so it is neither looked up nor stored
+        scope = None
+        if self.responses and not session.history:
+            with trace.span("cache"):
+                scope = self.responses.scope(facts, attached_files)
+                hit = self.responses.get(model, prompt, scope)
+            if hit: return {"prompt": prompt, "model": model, "route": route, "started": started, "cached": hit,
+                            "prewarm": self.prewarm_tracker.outcome(model), "trace": trace}
+
+        # Only load image data if we are actually using the vision model
+        images, sent, raw = [], 0, 0
+        is_vision_task = (model == MODELS["vision"])
+        
+        if is_vision_task:
+            for f in attached_files:
+                if f.lower().endswith(IMAGE_FILES):
+                    try:
+                        with trace.span("images"): payload, size, _ = self.images.encode(f)
+                    except Exception as e:
+                        emit("stream", f"[System Error loading image: {e}]")
+                        continue
+                    images.append(payload)
+                    sent, raw = sent + len(payload), raw + size
+
+        for path in attached_files:
+            if not path.lower().endswith(SKIP_FILES) and os.path.isfile(path) and not self.context.index.fresh(path):
+                emit("status", f"Indexing {os.path.basename(path)}...")
+        with trace.span("context"):
+            msgs, ctx = self.context.build(SYSTEM_PERSONA, facts, attached_files, session.history, prompt, session.context_start)
+            # Everything in memory made it into the prompt: older turns may fit too. Only the legacy
+            # layout reaches back like this; the stable one never starts before last turn's anchor,
+            # and trim_history keeps everything from the anchor on. Small steps, so a prompt that
+            # is nearly full doesn't pull in a page that the next save trims away again.
+            while self.context.layout != "stable" and ctx["start"] == 0 and self.load_older(session, HISTORY_RELOAD):
+                msgs, ctx = self.context.build(SYSTEM_PERSONA, facts, attached_files, session.history, prompt, session.context_start)
+        session.context_start = ctx["start"]
+        if images: msgs[-1]["images"] = images
+        emit("status", f"Switching to {model}... (context {ctx['used']}/{ctx['budget']} tokens)")
+
+        with trace.span("residency"): keep_alive = self.residency.before_request(model)
+        data = {
+            "model": model, 
+            "messages": msgs, 
+            "stream": True,
+            "options": {"num_ctx": NUM_CTX, "temperature": 0.3}, 
+            "keep_alive": keep_alive
+        }
+
+        if is_vision_task:
+            emit("status", f"Processing {len(images)} image(s), {sent / 2**20:.1f} MB sent of {raw / 2**20:.1f} MB (This may take 30s)...")
+        return {"prompt": prompt, "model": model, "route": route, "data": data, "timeout": 120 if is_vision_task else 30,
+                "started": started, "prewarm": self.prewarm_tracker.outcome(model), "context": ctx,
+                "images": {"count": len(images), "sent_bytes": sent, "raw_bytes": raw}, "cache_scope": scope, "trace": trace}
+
+    def log_thinking(self, session, turn, thinking):
+        entry = {"chat_id": session.chat_id, "model": turn["model"], "time": time.time(), "thinking": thinking}
+        with open(ensure_parent(THINKING_LOG), "a", encoding='utf-8') as f: f.write(json.dumps(entry) + "\n")
+
+    def finish_turn(self, session, turn, decoder, emit):
+        decoder.close()
+        self.residency.after_request(turn["model"], decoder.final)
+        self.prompt_eval.record(turn["model"], turn["context"], decoder.final)
+        trace = turn["trace"]
+        if decoder.first_token_at:
+            trace.add("ttft", decoder.first_token_at - turn["started"])
+            self.prewarm_tracker.record_ttft(turn["prewarm"], decoder.first_token_at - turn["started"])
+        if decoder.think_seconds: trace.add("thinking", decoder.think_seconds)
+        tags = decoder.filter
+        # Every <cmd> in the answer is offered, each for its own approval
+        for command_content in dict.fromkeys(tags.commands):
+            if command_content and command_content.lower() not in ["hello", "hi", "hey", "test", "cmd"]:
+                emit("approval_request", command_content)
+
+        if LOG_THINKING and tags.reasoning: self.log_thinking(session, turn, tags.thinking)
+        clean_res = tags.text.strip()
+        if turn["cache_scope"] is not None:
+            self.responses.put(turn["model"], turn["prompt"], turn["cache_scope"], clean_res, bool(tags.commands),
+                               time.perf_counter() - turn["started"])
+        session.history.append({"role": "user", "content": turn["prompt"]})
+        session.history.append({"role": "assistant", "content": clean_res})
+        with trace.span("save"): self.save_chat_history(session)
+        self.record_turn(session, turn, "generate", final=decoder.final)
+        return clean_res
+
+    def collect_after(self, attached_files):
+        # Image turns leave big base64/Pillow buffers behind; collect once the answer is
+        # out, on a background thread, instead of a full gc.collect() before every request
+        if self.gc_mode == "after_images" and any(f.lower().endswith(IMAGE_FILES) for f in attached_files):
+            threading.Thread(target=gc.collect, daemon=True).start()
+
+    def record_turn(self, session, turn, kind, **fields):
+        ctx, route = turn.get("context") or {}, turn.get("route")
+        return self.telemetry.record(turn["trace"], kind=kind, chat_id=session.chat_id, model=turn["model"],
+                                     route=route[2] if route else None, prewarm=turn.get("prewarm"),
+                                     context_tokens=ctx.get("used"), image_bytes=(turn.get("images") or {}).get("sent_bytes"), **fields)
+
+    def fail(self, session, turn, emit, reason, message):
+        # A failed turn still returns its message as the result (the GUI shows it), but also
+        # says so as an "error" event, so API callers can tell it apart from an answer
+        self.record_turn(session, turn, "error", error=reason)
+        emit("error", {"reason": reason, "message": message})
+        return message
+
+    def replay(self, session, turn, emit):
+        # A cached answer goes down the same "stream" path, but a <cmd> in it is only shown:
+        # it is never offered for approval (let alone run) again
+        hit = turn["cached"]
+        emit("status", f"Answered from cache ({hit['match']} match, ~{hit['seconds']:.1f} s saved)")
+        emit("stream", hit["answer"])
+        if hit["has_cmd"]: emit("status", "Cached answer contains a command: not run")
+        session.history.append({"role": "user", "content": turn["prompt"]})
+        session.history.append({"role": "assistant", "content": hit["answer"]})
+        with turn["trace"].span("save"): self.save_chat_history(session)
+        self.record_turn(session, turn, "cache")
+        return hit["answer"]
+
+    def generate(self, prompt, attached_files=[], force_logic=False, callback=None, session=None):
+        session = session or self.session
+        session.cancel.clear()
+        emit = callback or (lambda type, data: None)
+        p_clean = prompt.strip()
+        
+        if p_clean.startswith("/"):
+            response_text = self.run_slash_command(p_clean)
+            if response_text: emit("stream", response_text)
+            return response_text
+
+        with self.telemetry.profiled():
+            turn = self.prepare_turn(prompt, attached_files, force_logic, session, emit)
+            if "cached" in turn: return self.replay(session, turn, emit)
+            trace = turn["trace"]
+
+            try:
+                decoder = StreamDecoder(emit)
+                with trace.span("connect"): response = self.transport.request("POST", "/api/chat", turn["data"], timeout=turn["timeout"])
+                with response, trace.span("stream"):
+                    for line in response:
+                        if session.cancel.is_set():
+                            emit("status", "Stopped by User.")
+                            self.record_turn(session, turn, "stopped")
+                            return decoder.filter.text + " [STOPPED]"
+                        decoder.feed(line)
+                return self.finish_turn(session, turn, decoder, emit)
+
+            except urllib.error.URLError:
+                return self.fail(session, turn, emit, "connect", "Error: Could not connect to Ollama. Is it running?")
+            except Exception as e:
+                return self.fail(session, turn, emit, str(e), f"Error: {str(e)}")
+            finally:
+                self.collect_after(attached_files)
+
+    # Same pipeline as generate(), but as an async iterator of the callback events:
+    # ("stream" | "status" | "approval_request" | "error", data), then a final ("done", result).
+    # The socket is only read when the consumer asks for the next event.
+    async def agenerate(self, prompt, attached_files=[], force_logic=False, session=None):
+        session = session or self.session
+        session.cancel.clear()
+        events = []
+        emit = lambda type, data: events.append((type, data))
+        p_clean = prompt.strip()
+
+        if p_clean.startswith("/"):
+            response_text = self.run_slash_command(p_clean)
+            if response_text: yield ("stream", response_text)
+            yield ("done", response_text)
+            return
+
+        with self.telemetry.profiled() as profiling:
+            # File reads and image encoding stay off the event loop. cProfile only sees its own
+            # thread, so a profiled request runs them inline instead.
+            async def inline(fn, *args): return fn(*args)
+            offload = inline if profiling else asyncio.to_thread
+            turn = await offload(self.prepare_turn, prompt, attached_files, force_logic, session, emit)
+            if "cached" in turn: result = await offload(self.replay, session, turn, emit)
+            for event in events: yield event
+            events.clear()
+            if "cached" in turn:
+                yield ("done", result)
+                return
+
+            trace, opened = turn["trace"], []
+            try:
+                decoder = StreamDecoder(emit)
+                t0 = time.perf_counter()
+                try:
+                    async with contextlib.aclosing(self.atransport.stream("POST", "/api/chat", turn["data"], timeout=turn["timeout"],
+                                                                         on_open=lambda: opened.append(time.perf_counter()))) as lines:
+                        async for line in lines:
+                            if session.cancel.is_set():
+                                self.record_turn(session, turn, "stopped")
+                                yield ("status", "Stopped by User.")
+                                yield ("done", decoder.filter.text + " [STOPPED]")
+                                return
+                            decoder.feed(line)
+                            for event in events: yield event
+                            events.clear()
+                finally:
+                    # The same spans as generate(); "stream" includes time the consumer held us up
+                    trace.add("connect", (opened[0] if opened else time.perf_counter()) - t0)
+                    if opened: trace.add("stream", time.perf_counter() - opened[0])
+                result = await offload(self.finish_turn, session, turn, decoder, emit)
+            except urllib.error.URLError:
+                result = self.fail(session, turn, emit, "connect", "Error: Could not connect to Ollama. Is it running?")
+            except Exception as e:
+                result = self.fail(session, turn, emit, str(e), f"Error: {str(e)}")
+            finally:
+                self.collect_after(attached_files)
+            for event in events: yield event
+            yield ("done", result)
+
+    def new_chat(self):
+        self.session = self.new_session()
+        return "New Chat Started."
+
+# ==========================================
+#        ENGINE: HEADLESS CONCURRENT SESSIONS
+# ==========================================
+
+class SessionEngine:
+    # Many conversations against one backend (shared memory + connection pool),
+    # each turn running on a bounded worker pool. Turns within a session stay ordered.
+    # Beyond `max_sessions`, the least recently used idle sessions are dropped from memory;
+    # their chat is in the store, and open_session() loads it again when it is next used.
+    def __init__(self, backend=None, max_workers=ENGINE_WORKERS, max_sessions=ENGINE_SESSIONS):
+        self.backend = backend or AIBackend(OllamaTransport(pool_size=max_workers))
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="moe-session")
+        self.sessions = OrderedDict() # least recently used first
+        self.max_sessions = max_sessions
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def keep(self, session):
+        # Caller holds self.lock. Only sessions that are fully stored and have no turn queued
+        # or running are evicted; an API request's own unstored history stays until it closes it.
+        session = self.sessions.setdefault(session.chat_id, session)
+        self.sessions.move_to_end(session.chat_id)
+        excess = len(self.sessions) - self.max_sessions
+        for chat_id, old in list(self.sessions.items()):
+            if excess <= 0: break
+            if old is not session and old.persist and not old.pending and old.persisted == len(old.history):
+                del self.sessions[chat_id]
+                self.evicted += 1
+                excess -= 1
+        return session
+
+    def open_session(self, chat_id=None, turns=0):
+        # `turns` is added to the session's pending count under the same lock, so it can't
+        # be evicted between being looked up and its turn being queued
+        with self.lock:
+            session = self.sessions.get(chat_id)
+            if session:
+                session.pending += turns
+                return self.keep(session)
+        session = self.backend.load_session(chat_id) if chat_id else self.backend.new_session()
+        with self.lock:
+            session = self.keep(session)
+            session.pending += turns
+            return session
+
+    def add_session(self, session):
+        with self.lock: return self.keep(session)
+
+    def get_session(self, chat_id):
+        with self.lock: return self.sessions.get(chat_id)
+
+    def submit(self, chat_id, prompt, attached_files=(), force_logic=False, callback=None):
+        session = self.open_session(chat_id, turns=1)
+        session.cancel.clear()
+        try:
+            return self.pool.submit(self._run, session, prompt, list(attached_files), force_logic, callback)
+        except RuntimeError: # shut down
+            self.done(session)
+            raise
+
+    def done(self, session):
+        with self.lock: session.pending -= 1
+
+    def _run(self, session, prompt, attached_files, force_logic, callback):
+        try:
+            with session.lock:
+                # STOP pressed while the turn was still queued
+                if session.cancel.is_set(): return " [STOPPED]"
+                return self.backend.generate(prompt, attached_files, force_logic, callback, session=session)
+        finally:
+            self.done(session)
+
+    def stop(self, chat_id):
+        session = self.get_session(chat_id)
+        if session: session.cancel.set()
+
+    def close_session(self, chat_id):
+        self.stop(chat_id)
+        with self.lock: self.sessions.pop(chat_id, None)
+
+    def shutdown(self, wait=True):
+        with self.lock: sessions = list(self.sessions.values())
+        for session in sessions: session.cancel.set()
+        self.pool.shutdown(wait=wait)
+        self.backend.commands.shutdown(wait=wait)
+        self.backend.transport.close()
+
+# ==========================================
+#        SERVER: OPENAI-COMPATIBLE HTTP API
+# ==========================================
+
+class ApprovalBook:
+    # Commands the model asked to run, held until an API client explicitly approves or
+    # rejects them (the GUI asks with a messagebox instead). Unanswered ones expire.
+    def __init__(self, ttl=APPROVAL_TTL, limit=256):
+        self.ttl, self.limit = ttl, limit
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        while self.pending:
+            oldest = next(iter(self.pending.values()))
+            if oldest["created"] >= cutoff and len(self.pending) <= self.limit: break
+            self.pending.popitem(last=False)
+
+    def add(self, chat_id, command):
+        entry = {"id": f"appr_{os.urandom(8).hex()}", "session_id": chat_id, "command": command, "created": time.time()}
+        with self.lock:
+            self.pending[entry["id"]] = entry
+            self.expire()
+        return entry
+
+    def list(self, chat_id=None):
+        with self.lock:
+            self.expire()
+            return [e for e in self.pending.values() if chat_id is None or e["session_id"] == chat_id]
+
+    def take(self, approval_id):
+        with self.lock:
+            self.expire()
+            return self.pending.pop(approval_id, None)
+
+def message_text(content):
+    # OpenAI content is a string or a list of parts; only the text parts reach the experts
+    if isinstance(content, str): return content
+    if isinstance(content, list):
+        return "\n".join(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return ""
+
+class APIServer(ThreadingHTTPServer):
+    # One handler thread per connection; turns run on the SessionEngine's worker pool.
+    # `slots` bounds running + queued turns, anything beyond that gets 429 straight away.
+    daemon_threads = True
+
+    def __init__(self, engine, address=(SERVER_HOST, SERVER_PORT), workers=ENGINE_WORKERS, queue_size=SERVER_QUEUE, key=SERVER_KEY):
+        super().__init__(address, APIHandler)
+        self.engine = engine
+        self.approvals = ApprovalBook()
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.key = key
+
+class APIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MacroMoE/1.0"
+    MAX_BODY = 8 * 2**20
+
+    def log_message(self, format, *args): pass # per-request numbers go to the metrics file
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers: self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, kind="invalid_request_error", headers=()):
+        self.send_json(status, {"error": {"message": message, "type": kind}}, headers)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.MAX_BODY: raise ValueError("request body too large")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict): raise ValueError("request body must be a JSON object")
+        return body
+
+    def authorized(self):
+        if not self.server.key: return True
+        if self.headers.get("Authorization", "") == f"Bearer {self.server.key}": return True
+        self.send_error_json(401, "invalid API key", "authentication_error")
+        return False
+
+    def route(self):
+        return urllib.parse.urlsplit(self.path).path.rstrip("/")
+
+    def do_GET(self):
+        if not self.authorized(): return
+        path = self.route()
+        if path == "/health":
+            self.send_json(200, {"status": "ok", "ollama": OLLAMA_HOST})
+        elif path == "/v1/models":
+            names = ["macro-moe"] + sorted(MODELS)
+            self.send_json(200, {"object": "list", "data": [{"id": n, "object": "model", "owned_by": "macro-moe"} for n in names]})
+        elif path == "/v1/approvals":
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            chat_id = (query.get("session_id") or [None])[0]
+            self.send_json(200, {"object": "list", "data": self.server.approvals.list(chat_id)})
+        else:
+            self.send_error_json(404, f"no route for GET {path}")
+
+    def do_POST(self):
+        if not self.authorized(): return
+        path = self.route()
+        try:
+            body = self.read_json()
+        except (ValueError, UnicodeDecodeError) as e:
+            return self.send_error_json(400, f"bad JSON body: {e}")
+        if path == "/v1/chat/completions":
+            self.chat_completions(body)
+        elif path.startswith("/v1/approvals/"):
+            self.answer_approval(path.rsplit("/", 1)[1], body)
+        else:
+            self.send_error_json(404, f"no route for POST {path}")
+
+    def do_DELETE(self):
+        if not self.authorized(): return
+        path = self.route()
+        if path.startswith("/v1/sessions/"):
+            chat_id = path.rsplit("/", 1)[1]
+            self.server.engine.close_session(chat_id) # forgets it in memory; the chat stays in the store
+            self.send_json(200, {"id": chat_id, "object": "session", "closed": True})
+        else:
+            self.send_error_json(404, f"no route for DELETE {path}")
+
+    # The explicit approval step: POST /v1/approvals/<id> {"approve": true|false}
+    def answer_approval(self, approval_id, body):
+        entry = self.server.approvals.take(approval_id)
+        if entry is None: return self.send_error_json(404, f"no pending approval {approval_id} (answered or expired)")
+        approved = body.get("approve") is True
+        output = self.server.engine.backend.execute_command(entry["command"]) if approved else None
+        self.send_json(200, dict(entry, approved=approved, output=output))
+
+    def chat_completions(self, body):
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not messages or not isinstance(messages[-1], dict) or messages[-1].get("role") != "user":
+            return self.send_error_json(400, "messages must end with a user message")
+        prompt = message_text(messages[-1].get("content"))
+        if not prompt.strip(): return self.send_error_json(400, "the last user message has no text")
+        # /remember, /forget and /profile act on the memory and profiler every session shares:
+        # desktop-only, so one API client can't write into everyone's system prompt
+        if prompt.strip().startswith("/"): return self.send_error_json(400, "slash commands are only available in the desktop app")
+        engine = self.server.engine
+
+        # With a session id the server keeps the history and only the last message is new;
+        # without one the client's messages are the history, for this request only
+        chat_id = body.get("session_id") or self.headers.get("X-Session-Id")
+        ephemeral = not chat_id
+        if ephemeral:
+            history = [{"role": m["role"], "content": message_text(m.get("content"))}
+                       for m in messages[:-1] if isinstance(m, dict) and m.get("role") in ("user", "assistant")]
+            chat_id = engine.add_session(ChatSession(f"api_{os.urandom(6).hex()}", history, persist=False)).chat_id
+        elif not isinstance(chat_id, str) or not re.fullmatch(r"[\w.-]{1,128}", chat_id):
+            return self.send_error_json(400, "session_id may only contain letters, digits, '_', '-' and '.'")
+
+        if not self.server.slots.acquire(blocking=False):
+            if ephemeral: engine.close_session(chat_id)
+            return self.send_error_json(429, "too many requests queued, retry shortly", "rate_limit_error", [("Retry-After", "1")])
+        events = queue.Queue()
+        force_logic = body.get("model") in ("logic", MODELS["logic"])
+        try:
+            future = engine.submit(chat_id, prompt, force_logic=force_logic, callback=lambda t, d: events.put((t, d)))
+        except RuntimeError: # engine shut down
+            self.server.slots.release()
+            return self.send_error_json(503, "server is shutting down", "server_error")
+        future.add_done_callback(lambda f: (self.server.slots.release(), events.put(("done", f))))
+
+        completion = {"id": f"chatcmpl-{os.urandom(12).hex()}", "created": int(time.time()), "session_id": None if ephemeral else chat_id}
+        try:
+            if body.get("stream"): self.stream_completion(completion, chat_id, events)
+            else: self.full_completion(completion, chat_id, events)
+        except (BrokenPipeError, ConnectionResetError):
+            engine.stop(chat_id) # client went away: don't keep generating for nobody
+        finally:
+            if ephemeral: engine.close_session(chat_id)
+
+    def collect(self, chat_id, events, on_text=None, on_approval=None):
+        # Drain engine events until the turn is done
+        # -> (result, approvals, streamed anything, None or (HTTP status, error message))
+        approvals, streamed, error = [], False, None
+        while True:
+            kind, data = events.get()
+            if kind == "done":
+                try: return data.result(), approvals, streamed, error
+                except Exception as e: return None, approvals, streamed, (500, f"Error: {e}")
+            if kind == "error":
+                # Ollama unreachable -> 503, anything else it got wrong -> 502
+                error = (503 if data["reason"] == "connect" else 502, data["message"])
+            elif kind == "stream":
+                streamed = True
+                if on_text: on_text(data)
+            elif kind == "approval_request":
+                entry = self.server.approvals.add(chat_id, data)
+                approvals.append({"id": entry["id"], "command": data})
+                if on_approval: on_approval(approvals[-1])
+
+    def model_name(self, chat_id):
+        session = self.server.engine.get_session(chat_id)
+        return (session and session.model) or "macro-moe"
+
+    def full_completion(self, completion, chat_id, events):
+        result, approvals, _, error = self.collect(chat_id, events)
+        if error: return self.send_error_json(error[0], error[1], "server_error")
+        self.send_json(200, dict(completion, object="chat.completion", model=self.model_name(chat_id), approvals=approvals,
+                                 choices=[{"index": 0, "message": {"role": "assistant", "content": result}, "finish_reason": "stop"}]))
+
+    def send_event(self, payload):
+        self.wfile.write(b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")) + b"\n\n")
+        self.wfile.flush()
+
+    def stream_completion(self, completion, chat_id, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close") # no chunked encoding: the stream ends with the connection
+        self.end_headers()
+        self.close_connection = True
+        chunk = dict(completion, object="chat.completion.chunk", model="macro-moe")
+        def send_delta(delta, finish_reason=None, **extra):
+            chunk["model"] = self.model_name(chat_id)
+            self.send_event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra))
+
+        send_delta({"role": "assistant"})
+        on_text = lambda text: send_delta({"content": text})
+        # A requested command arrives as its own chunk with an extra "approval" field
+        result, _, streamed, error = self.collect(chat_id, events, on_text, lambda approval: send_delta({}, approval=approval))
+        if error:
+            # The 200 is already out: the failure goes down the stream as an error event
+            self.send_event({"error": {"message": error[1], "type": "server_error", "code": error[0]}})
+        else:
+            if not streamed and result: on_text(result) # e.g. " [STOPPED]" before the turn started
+            send_delta({}, "stop")
+        self.send_event(b"[DONE]")
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=ENGINE_WORKERS, queue_size=SERVER_QUEUE):
+    engine = SessionEngine(max_workers=workers)
+    server = APIServer(engine, (host, port), workers, queue_size)
+    print(f"Macro-MoE API on http://{host}:{server.server_address[1]}/v1 | Ollama: {OLLAMA_HOST} | "
+          f"{workers} workers, {queue_size} queued")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        engine.shutdown(wait=False)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Headless Macro-MoE server (OpenAI-compatible /v1/chat/completions)")
+    ap.add_argument("--host", default=SERVER_HOST)
+    ap.add_argument("--port", type=int, default=SERVER_PORT)
+    ap.add_argument("--workers", type=int, default=ENGINE_WORKERS, help="turns generated at the same time")
+    ap.add_argument("--queue", type=int, default=SERVER_QUEUE, help="turns allowed to wait for a worker")
+    args = ap.parse_args()
+    serve(args.host, args.port, args.workers, args.queue)
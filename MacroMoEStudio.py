@@ -1,6 +1,8 @@
-import sys, json, urllib.request, urllib.error, os, subprocess, base64, re, multiprocessing, time, datetime, threading, gc
+# Desktop GUI. Everything that talks to Ollama lives in MacroMoEBackend (no Tk imports there).
+import os, threading, time
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
+from MacroMoEBackend import AIBackend, HISTORY_PAGE, OLLAMA_HOST
 
 # --- GUI THEME SETUP ---
 HAS_CTK = False
@@ -12,285 +14,50 @@ try:
 except ImportError:
     pass # Fallback to standard tkinter
 
-# --- CONFIGURATION ---
-URL = "http://localhost:11434/api/chat"
-BASE_DIR = os.path.join(os.path.expanduser("~"), "ai_studio") 
-HISTORY_DIR = os.path.join(BASE_DIR, "chats")
-MEMORY_FILE = os.path.join(BASE_DIR, "memory.json")
-CPU_CORES = max(1, multiprocessing.cpu_count() - 2)
-
-if not os.path.exists(HISTORY_DIR): os.makedirs(HISTORY_DIR)
-
-# [VERIFIED] Dynamic Model Loading
-MODELS = {
-    "logic": os.getenv("AI_LOGIC_MODEL", "phi4-mini-reasoning:3.8b-q4_K_M"), 
-    "vision": os.getenv("AI_VISION_MODEL", "qwen3-vl:4b"), 
-    "chat": os.getenv("AI_CHAT_MODEL", "gemma3:4b")
-}
-
 # ==========================================
-#        BACKEND: INTELLIGENCE & SAFETY
+#        FRONTEND: FULL DESKTOP GUI
 # ==========================================
 
-class AIBackend:
-    def __init__(self):
-        self.memory = self.load_json(MEMORY_FILE, default={})
-        self.current_chat_id = f"chat_{int(time.time())}"
-        self.history = []
-        self.stop_signal = False
-
-    def load_json(self, path, default):
-        if os.path.exists(path) and os.path.isfile(path):
-            try:
-                with open(path, "r", encoding='utf-8') as f: return json.load(f)
-            except: return default
-        return default
-
-    def save_memory(self):
-        with open(MEMORY_FILE, "w", encoding='utf-8') as f: json.dump(self.memory, f)
-
-    def save_chat_history(self):
-        filepath = os.path.join(HISTORY_DIR, f"{self.current_chat_id}.json")
-        with open(filepath, "w", encoding='utf-8') as f: json.dump(self.history, f)
-
-    def load_chat_history(self, filename):
-        filepath = os.path.join(HISTORY_DIR, filename)
-        self.history = self.load_json(filepath, default=[])
-        self.current_chat_id = filename.replace(".json", "")
-        return self.history
-
-    def get_chat_list(self):
-        if not os.path.exists(HISTORY_DIR): return []
-        files = [f for f in os.listdir(HISTORY_DIR) if f.endswith(".json")]
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(HISTORY_DIR, x)), reverse=True)
-        return files
-    
-    def delete_chat(self, filename):
-        filepath = os.path.join(HISTORY_DIR, filename)
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                return True
-            except:
-                return False
-        return False
-
-    def stop_generation(self):
-        self.stop_signal = True
-
-    # [FINAL SECURITY CHECK]
-    def execute_command(self, cmd):
-        if not cmd or not cmd.strip():
-            return "Error: No command provided."
-
-        # 1. Block Shell Operators & Newlines to prevent "Command Injection"
-        #    Blocks: chaining (; & |), redirection (> <), subshells (` $), and multiline attacks (\n \r)
-        forbidden_chars = [";", "&", "|", ">", "<", "`", "$", "\n", "\r"]
-        if any(char in cmd for char in forbidden_chars):
-            return "Blocked: Special characters and command chaining are disabled for security."
-
-        # 2. Strict Whitelist (Cross-Platform)
-        allowed_commands = [
-            "ipconfig", "ifconfig", "ip", # Network
-            "dir", "ls",                  # File System
-            "ping", "netstat",            # Utilities
-            "systeminfo", "whoami",       # Info
-            "echo", "date", "time"        # Basics
-        ]
-        
-        # Extract the base command (e.g., 'ping' from 'ping google.com')
-        base_cmd = cmd.strip().split()[0].lower()
-        
-        if base_cmd not in allowed_commands:
-            return f"Blocked: '{base_cmd}' is not in the authorized whitelist."
-        
-        try:
-            # shell=True is safe here ONLY because we filtered operators above.
-            # It is required for 'dir' on Windows.
-            res = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, timeout=10)
-            return f"Output:\n{res.decode('utf-8', errors='ignore')}"
-        except subprocess.TimeoutExpired:
-            return "Error: Command timed out."
-        except Exception as e: 
-            return f"Error: {str(e)}"
-
-    def get_system_context(self, prompt, attached_files=[]):
-        ctx = [f"Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"]
-        ctx.append(f"OS: {os.name} ({sys.platform})")
-        
-        if self.memory:
-            ctx.append("User Facts:\n" + "\n".join([f"- {v}" for v in self.memory.values()]))
-
-        for file_path in attached_files:
-            if os.path.exists(file_path):
-                if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.exe', '.zip')):
-                    continue
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(2000)
-                        if len(content) == 2000: content += "... [Truncated]"
-                        ctx.append(f"--- FILE: {os.path.basename(file_path)} ---\n{content}")
-                except: pass
-        return "\n".join(ctx)
-
-    def generate(self, prompt, attached_files=[], force_logic=False, callback=None):
-        self.stop_signal = False
-        p_clean = prompt.strip()
-        
-        if p_clean.startswith("/"):
-            response_text = ""
-            if p_clean.startswith("/remember"):
-                self.memory[str(len(self.memory)+1)] = p_clean.replace("/remember","").strip()
-                self.save_memory()
-                response_text = "Memory Saved."
-            elif p_clean.startswith("/forget"):
-                self.memory = {}
-                self.save_memory()
-                response_text = "Memory Wiped."
-            if callback and response_text: callback("stream", response_text)
-            return response_text
-
-        gc.collect()
-        sys_ctx = self.get_system_context(prompt, attached_files)
-        
-        # --- ROUTER LOGIC ---
-        triggers = ["code", "math", "plan", "calc", "network", "ping", "internet", "status", "cmd", "ipconfig", "ifconfig", "ls", "dir"]
-        is_logic_needed = any(w in prompt.lower() for w in triggers)
-        has_image = any(f.lower().endswith(('.png', '.jpg', '.jpeg')) for f in attached_files)
-
-        # Priority Chain: Force Logic > Image Present > Keyword Trigger > Default Chat
-        if force_logic:
-            model = MODELS["logic"]
-        elif has_image:
-            model = MODELS["vision"]
-        elif is_logic_needed:
-            model = MODELS["logic"]
-        else:
-            model = MODELS["chat"]
-
-        # Only load image data if we are actually using the vision model
-        img_b64 = None
-        is_vision_task = (model == MODELS["vision"])
-        
-        if is_vision_task:
-            for f in attached_files:
-                if f.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    try:
-                        with open(f, "rb") as img_f: 
-                            img_b64 = base64.b64encode(img_f.read()).decode('utf-8')
-                    except Exception as e:
-                        if callback: callback("stream", f"[System Error loading image: {e}]")
-                    break
-
-        if callback: callback("status", f"Switching to {model}...")
-
-        system_persona = (
-            "You are a helpful desktop assistant. "
-            "GUIDELINES:\n"
-            "1. For greetings ('hello') or general questions, answer NORMALLY in plain text. "
-            "2. ONLY use <cmd>...</cmd> tags if the user specifically asks for a system task "
-            "(like checking network, listing files, or running a script). "
-            "\n"
-            "Example 1: User 'Hi' -> You: 'Hello! How can I help?'\n"
-            "Example 2: User 'Check IP' -> You: '<cmd>ipconfig</cmd>'"
-        )
-        
-        msgs = [{"role": "system", "content": f"{system_persona}\nCONTEXT:\n{sys_ctx}"}] + self.history[-10:]
-        u_msg = {"role": "user", "content": prompt}
-        if img_b64: u_msg["images"] = [img_b64]
-        msgs.append(u_msg)
-
-        timeout_val = 120 if is_vision_task else 30
-
-        data = {
-            "model": model, 
-            "messages": msgs, 
-            "stream": True,
-            "options": {"num_ctx": 4096, "temperature": 0.3}, 
-            "keep_alive": "5m"
-        }
-
-        try:
-            req = urllib.request.Request(URL, data=json.dumps(data).encode('utf-8'))
-            full_res = ""
-            buffer = ""
-            is_thinking = False
-            
-            if is_vision_task and callback: callback("status", "Processing Image (This may take 30s)...")
-            
-            with urllib.request.urlopen(req, timeout=timeout_val) as response:
-                for line in response:
-                    if self.stop_signal:
-                        if callback: callback("status", "Stopped by User.")
-                        return full_res + " [STOPPED]"
-
-                    if not line: continue
-                    try:
-                        chunk = json.loads(line.decode())
-                    except json.JSONDecodeError: continue
-
-                    text = chunk.get('message', {}).get('content', '')
-                    full_res += text
-                    buffer += text
-                    
-                    while True:
-                        if is_thinking:
-                            end_idx = buffer.find("</think>")
-                            if end_idx != -1:
-                                is_thinking = False
-                                buffer = buffer[end_idx+8:] 
-                                if callback: callback("status", "Answering...")
-                            else:
-                                if len(buffer) > 50: buffer = buffer[-20:]
-                                break
-                        else:
-                            start_idx = buffer.find("<think>")
-                            if start_idx != -1:
-                                if start_idx > 0 and callback: 
-                                    callback("stream", buffer[:start_idx])
-                                is_thinking = True
-                                buffer = buffer[start_idx+7:]
-                                if callback: callback("status", "Thinking... (Hiding Output)")
-                            else:
-                                potential_tag = False
-                                for i in range(1, 8): 
-                                    if buffer.endswith("<think>"[:i]):
-                                        potential_tag = True
-                                        break
-                                if not potential_tag:
-                                    if callback: callback("stream", buffer)
-                                    buffer = ""
-                                break
-
-            cmd_match = re.search(r"<cmd>(.*?)</cmd>", full_res, re.DOTALL)
-            if cmd_match:
-                command_content = cmd_match.group(1).strip()
-                if command_content.lower() in ["hello", "hi", "hey", "test", "cmd"]:
-                    cmd_match = None 
-
-            if cmd_match and callback: 
-                callback("approval_request", cmd_match.group(1).strip())
-            
-            clean_res = re.sub(r"<think>.*?</think>", "", full_res, flags=re.DOTALL).strip()
-            self.history.append({"role": "user", "content": prompt})
-            if "images" in u_msg: del u_msg["images"] 
-            self.history.append({"role": "assistant", "content": clean_res})
-            self.save_chat_history()
-            return clean_res
-
-        except urllib.error.URLError:
-            return "Error: Could not connect to Ollama. Is it running?"
-        except Exception as e:
-            return f"Error: {str(e)}"
-
-    def new_chat(self):
-        self.history = []
-        self.current_chat_id = f"chat_{int(time.time())}"
-        return "New Chat Started."
+STREAM_FLUSH_MS = 33       # ~30 redraws/s while streaming
+STREAM_FLUSH_CHARS = 2048  # or sooner, if this much text piles up
+PREWARM_DEBOUNCE_MS = 400  # typing pause before the predicted expert is pre-loaded
+HISTORY_LIST_PAGE = 200    # sidebar rows per step; the list fills in the background after first paint
 
-# ==========================================
-#        FRONTEND: FULL DESKTOP GUI
-# ==========================================
+class StreamBuffer:
+    # Worker threads push fragments; the Tk thread drains them once per frame
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.parts, self.size, self.oldest = [], 0, None
+            self.tokens, self.started, self.last, self.lag = 0, None, None, 0.0
+
+    def push(self, text):
+        # -> (started a new batch, crossed the size threshold)
+        now = time.perf_counter()
+        with self.lock:
+            first = not self.parts
+            if first: self.oldest = now
+            if self.started is None: self.started = now
+            self.parts.append(text)
+            self.size += len(text)
+            self.tokens += 1
+            self.last = now
+            return first, self.size - len(text) < STREAM_FLUSH_CHARS <= self.size
+
+    def drain(self):
+        with self.lock:
+            text, oldest = "".join(self.parts), self.oldest
+            self.parts, self.size, self.oldest = [], 0, None
+        if oldest is not None: self.lag = time.perf_counter() - oldest
+        return text
+
+    def rate(self):
+        with self.lock:
+            if not self.tokens or self.last == self.started: return 0.0
+            return self.tokens / (self.last - self.started)
 
 BaseClass = ctk.CTk if HAS_CTK else tk.Tk
 
@@ -320,6 +87,15 @@ class App(BaseClass):
         self.sidebar_lbl = lbl_cls(self.sidebar, **kw_lbl)
         self.sidebar_lbl.pack(pady=10)
 
+        if HAS_CTK:
+            self.search_entry = ctk.CTkEntry(self.sidebar, placeholder_text="Search chats...")
+        else:
+            self.search_entry = tk.Entry(self.sidebar, bg="#444", fg="white")
+        self.search_entry.pack(fill="x", padx=5)
+        self.search_entry.bind("<Return>", lambda e: self.refresh_history_ui())
+
+        self.history_ids = [] # chat id behind each listbox row
+        self.history_gen = 0  # bumped by every refresh, so rows from an older one are dropped
         self.history_list = tk.Listbox(self.sidebar, bg="#2b2b2b", fg="white", borderwidth=0, selectbackground="#444")
         self.history_list.pack(fill="both", expand=True, padx=5, pady=5)
         self.history_list.bind("<<ListboxSelect>>", self.load_selected_chat)
@@ -359,7 +135,17 @@ class App(BaseClass):
             self.chat_box = tk.Text(self.tab_chat, bg="#2b2b2b", fg="white", wrap="word", borderwidth=0)
         
         self.chat_box.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+        try:
+            self.chat_box.tag_config("ai_header", foreground="#58a6ff", font=("Arial", 10, "bold"))
+            self.chat_box.tag_config("system_msg", foreground="#ff7b72")
+        except: pass 
+        # Clickable first line while older messages of the open chat are still on disk
+        self.chat_box.tag_config("load_older", foreground="#58a6ff", underline=True)
+        self.chat_box.tag_bind("load_older", "<Button-1>", self.load_older_messages)
+        self.view_chat, self.view_offset = None, 0 # chat shown, and how many of its messages precede the view
         self.chat_box.configure(state="disabled")
+        self.stream_buffer = StreamBuffer()
+        self.command_seq = 0
 
         # --- FILES AREA ---
         lbl_file = lbl_cls(self.tab_files, text="Context Files / Images:")
@@ -391,6 +177,8 @@ class App(BaseClass):
             
         self.entry.pack(side="left", fill="both", expand=True, padx=(5, 10), pady=5)
         self.entry.bind("<Return>", self.send)
+        self.entry.bind("<KeyRelease>", self.schedule_prewarm)
+        self.prewarm_job = None
         
         self.logic_var = tk.BooleanVar(value=False)
         if HAS_CTK:
@@ -409,7 +197,8 @@ class App(BaseClass):
         self.send_btn.pack(side="right", padx=5)
 
         # --- STATUS BAR ---
-        self.status = lbl_cls(self, text="Ready | Ollama Link: http://localhost:11434")
+        self.status_msg = f"Ready | Ollama Link: {OLLAMA_HOST}"
+        self.status = lbl_cls(self, text=self.status_msg)
         if HAS_CTK: self.status.configure(text_color="gray")
         else: self.status.config(fg="gray", bg="#333")
         self.status.grid(row=2, column=1, sticky="w", padx=10, pady=(0, 5))
@@ -417,27 +206,75 @@ class App(BaseClass):
         self.refresh_history_ui()
 
     def refresh_history_ui(self):
+        # The chat list is read on a worker thread and added page by page, so neither the
+        # first paint nor a search waits for the database
+        self.history_gen += 1
         self.history_list.delete(0, "end")
-        for f in self.backend.get_chat_list(): self.history_list.insert("end", f)
+        self.history_ids = []
+        query = self.search_entry.get().strip()
+        threading.Thread(target=self.load_history_rows, args=(self.history_gen, query), daemon=True).start()
+
+    def load_history_rows(self, gen, query):
+        if query:
+            rows = self.backend.search_chats(query, limit=50)
+            self.after(0, self.add_history_rows, gen, [(chat_id, f"{chat_id}: {snippet}") for chat_id, snippet in rows])
+            return
+        offset = 0
+        while gen == self.history_gen:
+            ids = self.backend.get_chat_list(limit=HISTORY_LIST_PAGE, offset=offset)
+            if ids: self.after(0, self.add_history_rows, gen, [(chat_id, chat_id) for chat_id in ids])
+            if len(ids) < HISTORY_LIST_PAGE: return
+            offset += len(ids)
+
+    def add_history_rows(self, gen, rows):
+        if gen != self.history_gen: return
+        self.history_ids.extend(chat_id for chat_id, _ in rows)
+        self.history_list.insert("end", *(label for _, label in rows))
 
     def load_selected_chat(self, event):
         sel = self.history_list.curselection()
         if not sel: return
-        filename = self.history_list.get(sel[0])
+        filename = self.history_ids[sel[0]]
         history = self.backend.load_chat_history(filename)
+        self.view_chat, self.view_offset = self.backend.current_chat_id, self.backend.session.offset
         
         self.chat_box.configure(state="normal")
         self.chat_box.delete("1.0", "end")
+        self.chat_box.insert("end", self.format_messages(history))
+        self.show_load_older()
+        self.chat_box.see("end")
+        self.chat_box.configure(state="disabled")
+
+    def format_messages(self, history):
+        text = ""
         for msg in history:
             role = "You" if msg["role"] == "user" else "AI"
             content = msg.get("content", "")
             if "images" in msg: content += " [Image Attached]"
-            self.chat_box.insert("end", f"\n\n[{role}]: {content}")
-        self.chat_box.see("end")
+            text += f"\n\n[{role}]: {content}"
+        return text
+
+    def show_load_older(self):
+        if self.view_offset:
+            self.chat_box.insert("1.0", f"[System]: {self.view_offset} older messages. Click to load more.", "load_older")
+
+    def load_older_messages(self, event=None):
+        # Display only: the session keeps its own window, so the next prompt is unchanged
+        if not self.view_offset: return "break"
+        older = self.backend.store.load(self.view_chat, limit=HISTORY_PAGE, before=self.view_offset)
+        self.view_offset -= len(older)
+        self.chat_box.configure(state="normal")
+        marker = self.chat_box.tag_ranges("load_older")
+        if marker: self.chat_box.delete(marker[0], marker[1])
+        self.chat_box.insert("1.0", self.format_messages(older))
+        self.show_load_older()
+        self.chat_box.see("1.0")
         self.chat_box.configure(state="disabled")
+        return "break"
 
     def start_new_chat(self):
         self.backend.new_chat()
+        self.view_chat, self.view_offset = None, 0
         self.clear_files() # FIX: Files now clear on new chat
         self.chat_box.configure(state="normal")
         self.chat_box.delete("1.0", "end")
@@ -451,7 +288,7 @@ class App(BaseClass):
             messagebox.showinfo("Info", "Please select a chat to delete.")
             return
         
-        filename = self.history_list.get(sel[0])
+        filename = self.history_ids[sel[0]]
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {filename}?"):
             if self.backend.delete_chat(filename):
                 self.refresh_history_ui()
@@ -472,7 +309,17 @@ class App(BaseClass):
 
     def stop_gen(self):
         self.backend.stop_generation()
-        self.status.configure(text="Stopping...")
+        self.set_status("Stopping...")
+
+    def schedule_prewarm(self, e=None):
+        # Debounced: only once the user pauses typing
+        if self.prewarm_job: self.after_cancel(self.prewarm_job)
+        self.prewarm_job = self.after(PREWARM_DEBOUNCE_MS, self.prewarm)
+
+    def prewarm(self):
+        self.prewarm_job = None
+        text = self.entry.get()
+        if len(text.strip()) >= 3: self.backend.prewarm(text, list(self.attached_files), self.logic_var.get())
 
     def send(self, e=None):
         msg = self.entry.get()
@@ -493,15 +340,25 @@ class App(BaseClass):
         
         threading.Thread(target=self.run_ai, args=(msg, files_snapshot), daemon=True).start()
 
+    def set_status(self, text):
+        self.status_msg = text
+        rate = self.stream_buffer.rate()
+        if rate: text += f" | {rate:.1f} tok/s | UI lag {self.stream_buffer.lag * 1000:.0f} ms"
+        self.status.configure(text=text)
+
+    def flush_stream(self):
+        text = self.stream_buffer.drain()
+        if not text: return
+        self.chat_box.configure(state="normal")
+        self.chat_box.insert("end", text)
+        self.chat_box.see("end")
+        self.chat_box.configure(state="disabled")
+        self.set_status(self.status_msg)
+
     # [VERIFIED] UI Feedback with Tags
     def callback_handler(self, type, data):
+        self.flush_stream() # Keep buffered text ahead of whatever event comes next
         self.chat_box.configure(state="normal")
-        
-        # Configure styles if they don't exist
-        try:
-            self.chat_box.tag_config("ai_header", foreground="#58a6ff", font=("Arial", 10, "bold"))
-            self.chat_box.tag_config("system_msg", foreground="#ff7b72")
-        except: pass 
 
         if type == "start_stream":
             self.chat_box.insert("end", "\n\n[AI]: ", "ai_header")
@@ -509,21 +366,45 @@ class App(BaseClass):
             self.chat_box.insert("end", data)
             self.chat_box.see("end")
         elif type == "status":
-            self.status.configure(text=data)
+            self.set_status(data)
         elif type == "approval_request":
             # System alerts now stand out in red
             self.chat_box.insert("end", f"\n\n[SYSTEM]: Requesting permission for: {data}", "system_msg")
             if messagebox.askyesno("Security Alert", f"The AI wants to run this command:\n\n{data}\n\nAllow it?"):
-                res = self.backend.execute_command(data)
-                self.chat_box.insert("end", f"\n[RESULT]: {res}")
+                self.run_command(data)
         
         self.chat_box.configure(state="disabled")
 
+    def run_command(self, cmd):
+        # Runs on the backend's command pool. Each command writes at its own mark, so
+        # parallel commands (and whatever the AI says meanwhile) don't interleave.
+        self.command_seq += 1
+        mark = f"cmd_output_{self.command_seq}"
+        self.chat_box.insert("end", f"\n[RESULT]: ")
+        self.chat_box.mark_set(mark, "end-1c")
+        self.chat_box.mark_gravity(mark, "left")
+        future = self.backend.commands.submit(cmd, on_output=lambda text: self.after(0, self.append_output, mark, text))
+        future.add_done_callback(lambda f: self.after(0, self.chat_box.mark_unset, mark))
+
+    def append_output(self, mark, text):
+        self.chat_box.configure(state="normal")
+        self.chat_box.insert(mark, text)
+        self.chat_box.mark_set(mark, f"{mark} + {len(text)} chars")
+        self.chat_box.see(mark)
+        self.chat_box.configure(state="disabled")
+
     def run_ai(self, msg, files_snapshot):
+        self.stream_buffer.reset()
         self.after(0, self.callback_handler, "start_stream", None)
         
         def thread_safe_callback(t, d):
-            self.after(0, self.callback_handler, t, d)
+            if t != "stream":
+                self.after(0, self.callback_handler, t, d)
+                return
+            # Tokens are coalesced and painted on a frame timer instead of one redraw each
+            first, full = self.stream_buffer.push(d)
+            if full: self.after(0, self.flush_stream)
+            elif first: self.after(STREAM_FLUSH_MS, self.flush_stream)
 
         res = self.backend.generate(
             msg, 
@@ -532,7 +413,9 @@ class App(BaseClass):
             callback=thread_safe_callback
         )
         
-        self.after(0, self.status.configure, {"text": "Idle"})
+        last = self.backend.prompt_eval.last
+        idle = f"Idle | prompt eval {last['ms']:.0f} ms for {last['evaluated']} tokens" if last else "Idle"
+        self.after(0, self.callback_handler, "status", idle)
         self.after(0, self.refresh_history_ui)
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+# The async path, AIBackend.agenerate(), next to bench_engine's thread pool: many streams
+# multiplexed on one event loop, a consumer that stops pulling (the socket must stop being read
+# while it does), and the pieces of the shared pipeline generate() also has: "connect" and
+# "stream" spans in the metrics, and an armed /profile used up by the async request itself.
+#   python -m benchmarks.bench_agenerate --streams 64 --token-delay 0.005
+import argparse, asyncio, json, os, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama, ScriptedReply
+
+def make_backend(mock, metrics=None):
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), studio.AsyncOllamaTransport(mock.url, pool_size=64),
+                               router=studio.KeywordRouter())
+    backend.telemetry = studio.Telemetry(path=metrics or os.devnull, enabled=metrics is not None)
+    return backend
+
+async def one(backend, prompt):
+    # -> (seconds to the first streamed text, kinds of events seen)
+    t0, first, kinds = time.perf_counter(), None, set()
+    async for kind, data in backend.agenerate(prompt, session=backend.new_session()):
+        if kind == "stream" and first is None: first = time.perf_counter() - t0
+        kinds.add(kind)
+    return first, kinds
+
+async def concurrent(backend, n):
+    return await asyncio.gather(*(one(backend, f"stream {i}, tell me something") for i in range(n)))
+
+async def paused(backend, pause):
+    # Count the lines agenerate() takes off the socket while the consumer sits on one event
+    read, stream = [0], backend.atransport.stream
+    async def counted(*args, **kwargs):
+        async for line in stream(*args, **kwargs):
+            read[0] += 1
+            yield line
+    backend.atransport.stream = counted
+    events = backend.agenerate("tell me a long story")
+    async for kind, _ in events:
+        if kind == "stream": break
+    before = read[0]
+    await asyncio.sleep(pause)
+    during = read[0] - before
+    async for _ in events: pass
+    return during, read[0]
+
+async def drain(backend, prompt):
+    return [event async for event in backend.agenerate(prompt)]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--streams", type=int, default=64)
+    ap.add_argument("--token-delay", type=float, default=0.005)
+    ap.add_argument("--pause", type=float, default=0.5, help="seconds the slow consumer stops pulling")
+    args = ap.parse_args()
+
+    with MockOllama(reply=ScriptedReply(words=40), token_delay=args.token_delay) as mock:
+        backend = make_backend(mock)
+        t0 = time.perf_counter()
+        results = asyncio.run(concurrent(backend, args.streams))
+        wall = time.perf_counter() - t0
+        ttft = sorted(r[0] for r in results if r[0] is not None)
+        errors = sum("error" in kinds for _, kinds in results)
+        print(f"streams {args.streams} on one loop: {args.streams / wall:7.1f} turns/s | TTFT p50 {statistics.median(ttft) * 1000:.0f} ms "
+              f"| errors {errors}")
+        assert not errors and len(ttft) == args.streams
+
+    with MockOllama(reply=ScriptedReply(words=5000)) as mock:
+        during, total = asyncio.run(paused(make_backend(mock), args.pause))
+        print(f"pause   {args.pause:.1f} s without pulling: {during} lines read meanwhile (of {total})")
+        assert during == 0
+
+    metrics = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+    with MockOllama() as mock:
+        backend = make_backend(mock, metrics)
+        asyncio.run(drain(backend, "/profile"))
+        asyncio.run(drain(backend, "hello"))
+        with open(metrics) as f: recs = [json.loads(line) for line in f]
+        turn = next(r for r in recs if r.get("kind") == "generate")
+        print(f"spans   {sorted(turn['spans_ms'])} | profile records {sum(r.get('kind') == 'profile' for r in recs)} | "
+              f"still armed for the next request: {backend.telemetry.profile_armed}")
+        assert {"connect", "stream"} <= set(turn["spans_ms"]) and not backend.telemetry.profile_armed
+        assert any(r.get("kind") == "profile" for r in recs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Approved command execution, old vs. CommandRunner: how long a Tk-style main loop stalls
+# while a slow command runs, time to the first line of output, several commands from one
+# answer, and repeated read-only commands. Slow stand-ins for `ping` and `systeminfo` are put
+# first on PATH so the real whitelist is exercised. Also checks injection attempts stay
+# blocked and that every <cmd> in an answer is offered for approval.
+#   python -m benchmarks.bench_commands
+import argparse, os, subprocess, sys, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+INJECTIONS = ["echo hi; rm -rf /", "ls | sh", "whoami && id", "rm -rf /", "echo $HOME", "echo `id`",
+              "ls\nrm x", "cat /etc/passwd", "python -c 1", "ipconfig > out.txt", "", "   "]
+
+def fake_tools(lines, interval, sysinfo_delay):
+    bin_dir = tempfile.mkdtemp(prefix="ai_studio_bin_")
+    scripts = {"ping": f"for i in $(seq {lines}); do echo \"reply $i from 127.0.0.1\"; sleep {interval}; done",
+               "systeminfo": f"sleep {sysinfo_delay}; echo 'OS Name: Bench OS'; echo 'Total Physical Memory: 16,384 MB'"}
+    for name, body in scripts.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f: f.write("#!/bin/sh\n" + body + "\n")
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+def old_execute(cmd):
+    # What AIBackend.execute_command did, called straight from the Tk callback
+    res = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, timeout=10)
+    return f"Output:\n{res.decode('utf-8', errors='ignore')}"
+
+def main_loop_stall(start_command):
+    # Ticks every 10 ms like a GUI event loop; returns the longest gap between ticks
+    last = time.perf_counter()
+    done = start_command()
+    worst = 0.0
+    while True:
+        time.sleep(0.01)
+        now = time.perf_counter()
+        worst, last = max(worst, now - last), now
+        if done(): return worst
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ping-lines", type=int, default=5)
+    ap.add_argument("--ping-interval", type=float, default=0.3)
+    ap.add_argument("--sysinfo-delay", type=float, default=0.5)
+    ap.add_argument("--repeats", type=int, default=5)
+    args = ap.parse_args()
+    if sys.platform == "win32": raise SystemExit("uses /bin/sh stand-ins for ping and systeminfo")
+    fake_tools(args.ping_lines, args.ping_interval, args.sysinfo_delay)
+    runner = studio.CommandRunner()
+
+    # 1. Main loop stall while `ping` runs
+    def old_start():
+        old_execute("ping 127.0.0.1")
+        return lambda: True
+    def new_start():
+        return runner.submit("ping 127.0.0.1").done
+    print(f"stall   old {main_loop_stall(old_start) * 1000:7.0f} ms | new {main_loop_stall(new_start) * 1000:5.0f} ms "
+          f"(longest gap between 10 ms ticks)")
+
+    # 2. First output line
+    t0 = time.perf_counter()
+    old_execute("ping 127.0.0.1")
+    old_first = time.perf_counter() - t0
+    first = []
+    t0 = time.perf_counter()
+    runner.run("ping 127.0.0.1", on_output=lambda text: first or first.append(time.perf_counter() - t0))
+    new_total = time.perf_counter() - t0
+    print(f"ping    first output old {old_first * 1000:7.0f} ms | new {first[0] * 1000:5.0f} ms of {new_total * 1000:.0f} ms")
+
+    # 3. Several commands from one answer
+    commands = ["ping 127.0.0.1", "systeminfo", "whoami", "ping localhost"]
+    t0 = time.perf_counter()
+    old = [old_execute(c) for c in commands]
+    old_wall = time.perf_counter() - t0
+    runner.cache.clear()
+    t0 = time.perf_counter()
+    new = [f.result() for f in [runner.submit(c) for c in commands]]
+    print(f"batch   {len(commands)} commands old {old_wall * 1000:7.0f} ms | new {(time.perf_counter() - t0) * 1000:5.0f} ms")
+    assert old == new
+
+    # 4. Repeated read-only command
+    runner.cache.clear()
+    t0 = time.perf_counter()
+    for _ in range(args.repeats): old_execute("systeminfo")
+    old_wall = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(args.repeats): runner.run("systeminfo")
+    print(f"cache   systeminfo x{args.repeats} old {old_wall * 1000:7.0f} ms | new {(time.perf_counter() - t0) * 1000:5.0f} ms | {runner.stats}")
+    # Only the listed invocations are cached, not every command sharing their first word
+    # (harmless ones here: this really runs them)
+    runner.cache.clear()
+    for c in ["echo hi", "date", "ip link show", "whoami --help", "systeminfo"]:
+        runner.run(c)
+    print(f"cache   entries after mixed commands: {list(runner.cache)}")
+    assert list(runner.cache) == ["systeminfo"]
+
+    # 5. Whitelist and forbidden characters still hold
+    leaked = [c for c in INJECTIONS if not runner.run(c).startswith(("Blocked", "Error"))]
+    print(f"blocked {len(INJECTIONS) - len(leaked)}/{len(INJECTIONS)} injection attempts")
+    assert not leaked, leaked
+
+    # 6. Every <cmd> in an answer is offered for approval
+    reply = "Checking. <cmd>whoami</cmd> then <cmd>ipconfig</cmd> and <cmd>whoami</cmd> and <cmd>dir</cmd>"
+    with MockOllama(reply=reply) as mock:
+        backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+        events = []
+        backend.generate("who am I and what is my IP?", callback=lambda t, d: events.append((t, d)))
+    asked = [d for t, d in events if t == "approval_request"]
+    print(f"approve {asked}")
+    assert asked == ["whoami", "ipconfig", "dir"]
+    runner.shutdown(wait=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Prompt assembly: the old "last 10 messages + 2000 chars per file" vs. the token-budgeted
+# ContextBuilder. Checks that every packed request fits its budget (recounted from the
+# final messages) and times assembly on long histories, cold (files not yet indexed, token
+# counts not cached) and warm.
+#   python -m benchmarks.bench_context --messages 20000
+import argparse, os, random, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+
+WORDS = ("the a model file error token network cache python list value return thread socket "
+         "ollama request budget history memory expert router chunk stream latency").split()
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)) + rng.choice(".?!")
+
+def make_history(rng, n):
+    history = []
+    for i in range(n):
+        # mostly short turns, a few pasted logs / long answers
+        words = rng.choice([8, 20, 40, 80]) if rng.random() < 0.9 else rng.randint(400, 1500)
+        history.append({"role": "user" if i % 2 == 0 else "assistant", "content": sentence(rng, words)})
+    return history
+
+def make_file(rng, path, words):
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(words // 12): f.write(sentence(rng, 12) + "\n")
+    return path
+
+def recount(msgs):
+    return sum(studio.count_tokens(m["content"]) + studio.MSG_OVERHEAD for m in msgs)
+
+def old_context(facts, files, history, prompt):
+    # What prepare_turn sent before: no budget at all
+    ctx = ["Time: 2026-01-01 00:00", "OS: bench"]
+    if facts: ctx.append("User Facts:\n" + "\n".join(f"- {v}" for v in facts))
+    for path in files:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read(2000)
+        ctx.append(f"--- FILE: {os.path.basename(path)} ---\n{content}")
+    return [{"role": "system", "content": studio.SYSTEM_PERSONA + "\nCONTEXT:\n" + "\n".join(ctx)}] + history[-10:] + [{"role": "user", "content": prompt}]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=10000, help="history length")
+    ap.add_argument("--trials", type=int, default=300, help="random budget/file/history mixes to check")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="ai_studio_ctx_")
+
+    history = make_history(rng, args.messages)
+    files = [make_file(rng, os.path.join(tmp, f"f{i}.txt"), w) for i, w in enumerate((200, 3000, 60000))]
+    facts = [sentence(rng, rng.randint(5, 25)) for _ in range(40)]
+    prompt = sentence(rng, 30)
+
+    # Old assembly: how often does a request already overflow num_ctx (and lose its persona)?
+    over = 0
+    for _ in range(args.trials):
+        end = rng.randint(10, len(history))
+        sizes = recount(old_context(facts, rng.sample(files, rng.randint(0, 3)), history[:end], prompt))
+        over += sizes > studio.NUM_CTX
+    print(f"old: {over}/{args.trials} requests larger than num_ctx={studio.NUM_CTX}")
+
+    # Budget adherence over random mixes
+    index = studio.FileIndex(os.path.join(tmp, "index.db"))
+    worst, fails = 0.0, 0
+    for _ in range(args.trials):
+        builder = studio.ContextBuilder(budget=rng.choice([512, 1024, 3072, 8192, 32768]), index=index)
+        end = rng.randint(0, len(history))
+        msgs, report = builder.build(studio.SYSTEM_PERSONA, facts[:rng.randint(0, 40)],
+                                     rng.sample(files, rng.randint(0, 3)), history[:end], prompt)
+        real = recount(msgs)
+        if real > report["budget"] or real > report["used"]: fails += 1
+        worst = max(worst, real / report["budget"])
+        if msgs[1]["role"] != "user": fails += 1
+    print(f"new: {fails} budget violations in {args.trials} trials, fullest request {worst:.0%} of budget")
+
+    # Assembly speed on the full history
+    builder = studio.ContextBuilder(index=studio.FileIndex(os.path.join(tmp, "cold.db")))
+    for label in ("cold", "warm"):
+        if label == "cold": studio.count_tokens.cache_clear()
+        times = []
+        for i in range(50 if label == "warm" else 1):
+            t0 = time.perf_counter()
+            msgs, report = builder.build(studio.SYSTEM_PERSONA, facts, files, history, prompt)
+            times.append(time.perf_counter() - t0)
+        print(f"{label:<5} build {statistics.median(times) * 1000:7.3f} ms | {report}")
+
+    t0 = time.perf_counter()
+    for _ in range(50): old_context(facts, files, history, prompt)
+    print(f"old   build {(time.perf_counter() - t0) / 50 * 1000:7.3f} ms")
+    assert fails == 0
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Throughput of the headless SessionEngine as concurrency grows. The mock streams
+# with a per-token delay so each turn behaves like a (fast) real generation. Then many
+# distinct sessions through a small session cap: memory stays bounded, and an evicted
+# session comes back from the store with its history.
+#   python -m benchmarks.bench_engine --turns 64 --token-delay 0.005
+import argparse, os, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+def run(url, workers, turns):
+    engine = studio.SessionEngine(studio.AIBackend(studio.OllamaTransport(url, pool_size=workers)), max_workers=workers)
+    sessions = [engine.open_session().chat_id for _ in range(workers)]
+    t0 = time.perf_counter()
+    futures = [engine.submit(sessions[i % workers], f"hello number {i}") for i in range(turns)]
+    results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - t0
+    engine.shutdown()
+    errors = sum(1 for r in results if r.startswith("Error"))
+    return elapsed, errors
+
+def churn(url, sessions, cap, workers=8):
+    engine = studio.SessionEngine(studio.AIBackend(studio.OllamaTransport(url, pool_size=workers)), max_workers=workers, max_sessions=cap)
+    ids = [f"bench_churn_{i}" for i in range(sessions)]
+    peak = 0
+    for round_ in range(2):
+        # In waves of `workers`, like a server whose queue is full: queued sessions are never evicted
+        for i in range(0, sessions, workers):
+            futures = [engine.submit(chat_id, f"round {round_} from {chat_id}") for chat_id in ids[i:i + workers]]
+            for f in futures: f.result()
+            peak = max(peak, len(engine.sessions))
+    first = engine.open_session(ids[0])
+    history = [m["content"] for m in first.history if m["role"] == "user"]
+    engine.shutdown()
+    return peak, engine.evicted, history
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=64)
+    ap.add_argument("--token-delay", type=float, default=0.005)
+    ap.add_argument("--levels", default="1,2,4,8,16,32")
+    ap.add_argument("--sessions", type=int, default=300)
+    ap.add_argument("--max-sessions", type=int, default=32)
+    args = ap.parse_args()
+
+    with MockOllama(token_delay=args.token_delay) as mock:
+        base = None
+        for workers in [int(x) for x in args.levels.split(",")]:
+            elapsed, errors = run(mock.url, workers, args.turns)
+            rate = args.turns / elapsed
+            base = base or rate
+            print(f"workers {workers:>3} | {rate:8.1f} turns/s | speedup x{rate / base:5.2f} | errors {errors}")
+        peak, evicted, history = churn(mock.url, args.sessions, args.max_sessions)
+        print(f"churn   {args.sessions} sessions x2 turns, cap {args.max_sessions}: peak {peak} in memory, "
+              f"{evicted} evicted | reloaded bench_churn_0 asked {history}")
+        assert peak <= args.max_sessions + 8 and len(history) == 2
+
+if __name__ == "__main__":
+    main()
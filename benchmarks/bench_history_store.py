@@ -0,0 +1,75 @@
+# Chat history cost: legacy chats/<id>.json full rewrite per turn + listdir/getmtime
+# sidebar refresh, vs. ChatStore appends and the recency index. Also times the migrator.
+#   python -m benchmarks.bench_history_store --turns 1000 --chats 5000
+import argparse, json, os, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+
+def message(i):
+    role = "user" if i % 2 == 0 else "assistant"
+    return {"role": role, "content": f"message {i} " + "lorem ipsum dolor sit amet " * 20}
+
+def legacy_save(path, history):
+    with open(path, "w", encoding='utf-8') as f: json.dump(history, f)
+
+def legacy_list(history_dir):
+    files = [f for f in os.listdir(history_dir) if f.endswith(".json")]
+    files.sort(key=lambda x: os.path.getmtime(os.path.join(history_dir, x)), reverse=True)
+    return files
+
+def bench_turns(root, turns):
+    history, legacy_times, store_times = [], [], []
+    store = studio.ChatStore(os.path.join(root, "turns.db"), legacy_dir=os.path.join(root, "none"))
+    path = os.path.join(root, "chat_turns.json")
+    for t in range(turns):
+        history += [message(2 * t), message(2 * t + 1)]
+        t0 = time.perf_counter()
+        legacy_save(path, history)
+        legacy_times.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        store.append("chat_turns", history[-2:])
+        store_times.append(time.perf_counter() - t0)
+    store.close()
+    tail = max(1, turns // 10)
+    for name, times in (("legacy json", legacy_times), ("chat store", store_times)):
+        print(f"save/turn  {name:<12} first {sum(times[:tail]) / tail * 1000:7.3f} ms | last {sum(times[-tail:]) / tail * 1000:7.3f} ms | total {sum(times):7.3f} s")
+
+def bench_listing(root, chats, repeat=5):
+    legacy_dir = os.path.join(root, "chats")
+    os.makedirs(legacy_dir)
+    for i in range(chats):
+        legacy_save(os.path.join(legacy_dir, f"chat_{i}.json"), [message(0), message(1)])
+
+    t0 = time.perf_counter()
+    for _ in range(repeat): legacy_list(legacy_dir)
+    legacy = (time.perf_counter() - t0) / repeat
+
+    store = studio.ChatStore(os.path.join(root, "list.db"), legacy_dir=legacy_dir)
+    t0 = time.perf_counter()
+    store.db  # first open runs the migrator
+    migrate = time.perf_counter() - t0
+    assert len(store.list_chats()) == chats
+
+    t0 = time.perf_counter()
+    for _ in range(repeat): store.list_chats()
+    indexed = (time.perf_counter() - t0) / repeat
+    t0 = time.perf_counter()
+    for _ in range(repeat): store.list_chats(limit=100)
+    paged = (time.perf_counter() - t0) / repeat
+    store.close()
+
+    print(f"list {chats} chats  legacy {legacy * 1000:8.2f} ms | index {indexed * 1000:8.2f} ms | first 100 {paged * 1000:6.2f} ms")
+    print(f"migrate    {chats} chats in {migrate:.2f} s ({chats / migrate:.0f} chats/s)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=1000)
+    ap.add_argument("--chats", type=int, default=5000)
+    args = ap.parse_args()
+    root = tempfile.mkdtemp(prefix="history_bench_")
+    bench_turns(root, args.turns)
+    bench_listing(root, args.chats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Vision requests with two attached photos: payload size and end-to-end time for the old
+# path (read + base64 the original every request), downscaling alone, and downscaling with
+# the content-addressed cache. The mock charges --image-delay seconds per MB it receives.
+# Needs Pillow to generate the test photos.
+#   python -m benchmarks.bench_images --turns 10
+import argparse, os, random, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+def make_photo(path, size, seed):
+    # Noisy gradients compress about as badly as a real camera photo
+    from PIL import Image
+    rng = random.Random(seed)
+    w, h = size
+    img = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    noise = Image.frombytes("RGB", (w, h), rng.randbytes(w * h * 3))
+    Image.blend(img, noise, 0.35).save(path, quality=95)
+    return path
+
+def run(label, mock, photos, args, cache):
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+    before = mock.stats["image_bytes"]
+    times = []
+    for i in range(args.turns):
+        if cache is None: backend.images = studio.ImageCache(max_side=0)  # old path: nothing kept, original size
+        elif not cache: backend.images = studio.ImageCache()
+        t0 = time.perf_counter()
+        backend.generate(f"what is different between these two photos? ({i})", attached_files=photos)
+        times.append(time.perf_counter() - t0)
+    sent = (mock.stats["image_bytes"] - before) / args.turns
+    print(f"{label:<20} {sent / 2**20:7.2f} MB/request | first {times[0] * 1000:7.1f} ms | "
+          f"mean {sum(times) / len(times) * 1000:7.1f} ms | {backend.images.stats}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=10)
+    ap.add_argument("--image-delay", type=float, default=0.05, help="mock seconds per MB of image payload")
+    args = ap.parse_args()
+    if not studio.HAS_PIL: raise SystemExit("Pillow is required: pip install Pillow")
+
+    tmp = tempfile.mkdtemp(prefix="ai_studio_images_")
+    photos = [make_photo(os.path.join(tmp, "a.jpg"), (4032, 3024), 1), make_photo(os.path.join(tmp, "b.jpg"), (3000, 4000), 2)]
+    print(f"photos: {sum(os.path.getsize(p) for p in photos) / 2**20:.1f} MB on disk")
+    with MockOllama(image_delay=args.image_delay) as mock:
+        run("original, no cache", mock, photos, args, None)
+        run("downscaled, no cache", mock, photos, args, False)
+        run("downscaled + cache", mock, photos, args, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# One long chat (1000+ turns) through generate() with the old memory handling (full
+# gc.collect() before every request, whole history kept in memory) and the new one
+# (collect only after image turns, off the hot path; history capped at AI_HISTORY_KEEP
+# with older turns reloaded from disk only when a legacy-layout prompt has room), plus the
+# new handling with the cap off. Counts the rows re-read from disk. A heap of long-lived
+# objects stands in for the GUI's widgets, which is what makes each forced collection slow.
+#   python -m benchmarks.bench_long_session --turns 1500
+import argparse, gc, os, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama, ScriptedReply
+
+def rss_mb():
+    # Current (not peak) RSS, so the two runs can share a process
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return float("nan")
+
+def window(times, start, size):
+    part = sorted(times[start:start + size])
+    return statistics.median(part) * 1000, part[int(len(part) * 0.95)] * 1000
+
+def run(label, mock, args, gc_mode, keep):
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+    backend.telemetry = studio.Telemetry(enabled=False)
+    backend.gc_mode, backend.history_keep = gc_mode, keep
+    session = backend.new_session()
+    reread, load = [0], backend.store.load
+    def counted(*a, **kw):
+        rows = load(*a, **kw)
+        reread[0] += len(rows)
+        return rows
+    backend.store.load = counted
+    gc.collect()
+    rss0 = rss_mb()
+    times = []
+    for i in range(args.turns):
+        t0 = time.perf_counter()
+        backend.generate(f"turn {i}: tell me a bit more about the last point", session=session)
+        times.append(time.perf_counter() - t0)
+    w = args.window
+    first, last = window(times, 0, w), window(times, len(times) - w, w)
+    print(f"{label:<8} first {w}: p50/p95 {first[0]:6.1f}/{first[1]:6.1f} ms | last {w}: p50/p95 {last[0]:6.1f}/{last[1]:6.1f} ms | "
+          f"RSS +{rss_mb() - rss0:6.1f} MB | history in memory {len(session.history)} (+{session.offset} on disk) | "
+          f"stored {backend.store.count(session.chat_id)} | re-read {reread[0]}")
+    return session
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=1200)
+    ap.add_argument("--window", type=int, default=100, help="turns per latency window")
+    ap.add_argument("--words", type=int, default=60, help="visible words per answer")
+    ap.add_argument("--token-delay", type=float, default=0.0)
+    ap.add_argument("--heap-objects", type=int, default=500_000, help="long-lived objects a GUI would hold")
+    args = ap.parse_args()
+
+    heap = [{"widget": i, "children": []} for i in range(args.heap_objects)]
+    reply = ScriptedReply(args.words, think_words=10, cmd_every=0)
+    with MockOllama(reply=reply, token_delay=args.token_delay) as mock:
+        run("old", mock, args, "always", 0)
+        run("no cap", mock, args, "after_images", 0)
+        session = run("new", mock, args, "after_images", studio.HISTORY_KEEP or 200)
+    assert session.offset + len(session.history) == args.turns * 2
+    assert len(session.history) < 2 * (studio.HISTORY_KEEP or 200)
+    del heap
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Time-to-first-token with and without prewarm() while the user is "typing". The mock
+# keeps one model resident and takes --load-delay to load one, and turns alternate
+# experts, so every turn needs a load.
+#   python -m benchmarks.bench_prewarm
+import argparse, os, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+PROMPTS = [
+    "hello, how was your weekend?",
+    "ping google.com and report the latency",
+    "tell me a fun fact about octopuses",
+    "calculate 15% tip on 84 dollars",
+    "what's a good movie for tonight?",
+    "ls the downloads folder",
+] * 3
+
+def run(prewarm, args):
+    mock = MockOllama(load_delay=args.load_delay, max_loaded=1).start()
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+    for prompt in PROMPTS:
+        if prewarm:
+            # The GUI calls this after a 400 ms typing pause; here, halfway through the prompt
+            backend.prewarm(prompt[:len(prompt) // 2 + 4])
+        time.sleep(args.typing)
+        backend.generate(prompt)
+    mock.stop()
+    return backend.prewarm_tracker.snapshot(), mock.stats["loads"]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--load-delay", type=float, default=0.4)
+    ap.add_argument("--typing", type=float, default=0.6, help="seconds between prewarm and Enter")
+    args = ap.parse_args()
+    for label, prewarm in (("no prewarm", False), ("prewarm", True)):
+        snap, loads = run(prewarm, args)
+        ttft = [v for k, v in snap.items() if k.startswith("ttft_") and v is not None]
+        print(f"{label:<11} mean TTFT {sum(ttft) / len(ttft):7.1f} ms | loads {loads} | {snap}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Prompt evaluation per turn with the "legacy" layout (time, facts and files in the system
+# message) vs. the "stable" one (byte-stable persona/facts/history prefix, volatile data last).
+# The mock keeps each model's last prompt like Ollama's KV cache and only charges
+# --prompt-token-ms for tokens after the common prefix; the clock moves a minute per turn.
+#   python -m benchmarks.bench_prompt_cache --turns 40
+import argparse, datetime, os, tempfile, types
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+REPLY = ("Sure. Here is a longer answer that walks through the steps one at a time, explains why "
+         "each of them matters and ends with a short summary so the history keeps growing.")
+
+class MinuteClock(datetime.datetime):
+    ticks = 0
+    @classmethod
+    def now(cls, tz=None):
+        cls.ticks += 1
+        return datetime.datetime(2026, 1, 1, 9, 0) + datetime.timedelta(minutes=cls.ticks)
+
+def run(layout, args, notes):
+    mock = MockOllama(reply=REPLY, prompt_token_delay=args.prompt_token_ms / 1000).start()
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+    backend.context = studio.ContextBuilder(budget=args.budget, layout=layout)
+    backend.memory = {str(i): f"fact number {i} about the user" for i in range(1, 6)}
+    for i in range(args.turns):
+        files = [notes] if i % 4 == 3 else []
+        backend.generate(f"question {i}: tell me something about topic {i}", attached_files=files)
+    mock.stop()
+    return backend.prompt_eval.snapshot()[layout]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=40)
+    ap.add_argument("--budget", type=int, default=1500, help="context budget in tokens (small, so the window slides)")
+    ap.add_argument("--prompt-token-ms", type=float, default=1.0, help="mock prompt evaluation cost per token")
+    args = ap.parse_args()
+    studio.datetime = types.SimpleNamespace(datetime=MinuteClock)
+
+    notes = os.path.join(tempfile.mkdtemp(prefix="ai_studio_notes_"), "notes.txt")
+    with open(notes, "w", encoding="utf-8") as f:
+        f.write("meeting notes: the build is green, the release is on friday, ship the fix.\n" * 20)
+
+    for layout in ("legacy", "stable"):
+        snap = run(layout, args, notes)
+        print(f"{layout:<7} prompt eval {snap['prompt_eval_ms']:7.1f} ms/turn | evaluated {snap['evaluated_tokens']:5d} "
+              f"of {snap['packed_tokens']:5d} packed tokens | {snap['turns']} turns")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Expert swaps and load time with the old fixed keep_alive="5m" vs. ResidencyManager,
+# against a mock Ollama that simulates model loads, a 2-model VRAM limit and keep_alive expiry.
+#   python -m benchmarks.bench_residency
+import argparse, os, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+class ScriptRouter:
+    # Prompts look like "logic: ..." so the workload decides the expert
+    def route(self, prompt):
+        return prompt.split(":")[0], 1.0, "script"
+
+class StaticResidency:
+    # What generate() did before: always keep_alive "5m", no unloads, no pre-warming
+    def before_request(self, model): return "5m"
+    def after_request(self, model, final): pass
+    def snapshot(self): return {}
+
+WORKLOADS = {
+    # 3 experts, VRAM for 2: plain LRU eviction misses on every turn of this cycle
+    "cyclic experts": [("chat", 0.3), ("logic", 0.3), ("vision", 0.3)] * 8,
+    # Mostly chat with ~8 minute pauses (scaled): a fixed 5m keep_alive lets it expire
+    "chat with pauses": [("chat", 0.4), ("chat", 0.4), ("logic", 0.05), ("chat", 0.4)] * 6,
+}
+
+def run(workload, managed, args):
+    mock = MockOllama(load_delay=args.load_delay, max_loaded=2, time_scale=args.time_scale).start()
+    transport = studio.OllamaTransport(mock.url)
+    backend = studio.AIBackend(transport, router=ScriptRouter())
+    if managed:
+        backend.residency = studio.ResidencyManager(transport, budget_mb=2 * 4096, ps_interval=0)
+    else:
+        backend.residency = StaticResidency()
+    ttft = []
+    t_start = time.perf_counter()
+    for expert, think_time in workload:
+        first = []
+        t0 = time.perf_counter()
+        backend.generate(f"{expert}: question", callback=lambda t, d: t == "stream" and not first and first.append(time.perf_counter()))
+        ttft.append((first[0] if first else time.perf_counter()) - t0)
+        time.sleep(think_time)  # user reading / typing; pre-warming happens here
+    wall = time.perf_counter() - t_start
+    stats = dict(mock.stats)
+    mock.stop()
+    return stats, ttft, wall, backend.residency.snapshot()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--load-delay", type=float, default=0.25, help="seconds per simulated model load")
+    ap.add_argument("--time-scale", type=float, default=1 / 1200, help="real seconds per keep_alive second")
+    args = ap.parse_args()
+
+    for name, workload in WORKLOADS.items():
+        print(f"-- {name} ({len(workload)} turns)")
+        for label, managed in (("fixed 5m", False), ("residency", True)):
+            stats, ttft, wall, snap = run(workload, managed, args)
+            print(f"{label:<10} loads {stats['loads']:>3} | load time {stats['load_seconds']:5.2f} s | unloads {stats['unloads']:>3} | "
+                  f"TTFT mean {statistics.mean(ttft) * 1000:6.1f} ms | wall {wall:5.2f} s")
+            if snap: print(f"           manager: {snap}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Repeated status / how-to questions with and without the response cache: hit rate, mean
+# latency, and that cached answers with <cmd> never reach the approval step again.
+# Near-duplicate matching uses the mock's bag-of-words embeddings. Also checks that a
+# follow-up inside a chat is never answered from the cache.
+#   python -m benchmarks.bench_response_cache --requests 200
+import argparse, os, random, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+QUESTIONS = [
+    ["How do I reset my password?", "how do i reset my password", "How do I reset my password please?"],
+    ["What is my IP address?", "what is my ip address??", "my IP address, what is it?"],
+    ["How do I export a chat?", "how do I export a chat"],
+    ["What models are installed?", "which models are installed?"],
+    ["How do I clear the memory?", "how do i clear the memory"],
+    ["What does force logic do?", "what does force logic do"],
+    ["list the files in this folder", "List the files in this folder."],
+    ["How do I attach an image?", "how do I attach an image"],
+]
+
+def reply(body):
+    prompt = body["messages"][-1]["content"].lower()
+    if "ip address" in prompt: return "Let me check. <cmd>ipconfig</cmd>"
+    if "list the files" in prompt: return "Here you go: <cmd>dir</cmd>"
+    return "Here is how: " + " ".join(["open the settings panel and follow the steps"] * 6)
+
+def run(label, mock, args, similarity):
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url), router=studio.KeywordRouter())
+    if similarity is not None:
+        embed = lambda p: studio.OllamaEmbedder(backend.transport)([p])[0]
+        backend.responses = studio.ResponseCache(os.path.join(tempfile.mkdtemp(), "responses.db"), similarity=similarity, embed=embed)
+    rng = random.Random(args.seed)
+    approvals, times = {"miss": 0, "hit": 0}, []
+    for _ in range(args.requests):
+        group = QUESTIONS[min(int(rng.paretovariate(1.2)) - 1, len(QUESTIONS) - 1)]
+        events = []
+        t0 = time.perf_counter()
+        # each question opens its own chat: only standalone questions are cached
+        backend.generate(rng.choice(group), callback=lambda t, d: events.append((t, d)), session=backend.new_session())
+        times.append(time.perf_counter() - t0)
+        cached = any(t == "status" and d.startswith("Answered from cache") for t, d in events)
+        approvals["hit" if cached else "miss"] += sum(t == "approval_request" for t, _ in events)
+    snap = backend.responses.snapshot() if backend.responses else {}
+    print(f"{label:<10} mean {sum(times) / len(times) * 1000:7.1f} ms | hit rate {snap.get('hit_rate') or 0:.0%} "
+          f"(near {snap.get('near_hits', 0)}) | approvals asked: fresh {approvals['miss']}, cached {approvals['hit']} | "
+          f"lookup {snap.get('lookup_seconds', 0) / max(1, snap.get('lookups', 1)) * 1000:.2f} ms")
+    assert approvals["hit"] == 0
+    if backend.responses:
+        session = backend.new_session()
+        backend.generate(QUESTIONS[0][0], session=session)
+        lookups = backend.responses.stats["lookups"]
+        backend.generate(QUESTIONS[0][0], session=session) # same words, but now a follow-up
+        assert backend.responses.stats["lookups"] == lookups
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--token-delay", type=float, default=0.004)
+    ap.add_argument("--seed", type=int, default=11)
+    args = ap.parse_args()
+    with MockOllama(reply=reply, token_delay=args.token_delay) as mock:
+        run("no cache", mock, args, None)
+        run("exact", mock, args, 0)
+        run("near 0.9", mock, args, 0.9)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Chunked retrieval over a large attached log: indexing throughput, peak memory while
+# indexing, retrieval latency once indexed, and whether the lines a question is about make it
+# into the prompt (the old path only ever saw the first 2000 characters). Also attaches an
+# unrelated log next to it, in both orders: the matching lines must get in either way.
+#   python -m benchmarks.bench_retrieval --mb 300
+import argparse, os, random, resource, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+
+TEMPLATES = [
+    "INFO worker-{w} request {n} served in {ms} ms",
+    "DEBUG cache lookup key=user:{n} hit={h}",
+    "INFO scheduler tick {n}, {w} jobs queued",
+    "WARN slow query on table orders took {ms} ms",
+    "DEBUG connection pool size={w} idle={h}",
+]
+NEEDLES = {
+    "why did the disk quota fail on the archive volume?": "ERROR disk quota exceeded on archive volume vol7, writes rejected",
+    "what happened with the certificate renewal?": "ERROR certificate renewal failed: ACME challenge timed out for api.example.org",
+    "was there a kernel oom kill?": "CRIT kernel oom-killer terminated process postgres pid 4411",
+}
+
+def write_log(path, mb, rng):
+    # Repeated pre-rendered blocks keep generation fast; the needles go in at random depths
+    block = "".join(f"2026-01-01T{i % 24:02d}:{i % 60:02d}:00 " + rng.choice(TEMPLATES).format(
+        w=rng.randint(1, 32), n=rng.randint(1, 10**6), ms=rng.randint(1, 999), h=rng.random() < 0.5) + "\n"
+        for i in range(5000)).encode()
+    blocks = max(1, mb * 2**20 // len(block))
+    at = {rng.randrange(blocks): line for line in NEEDLES.values()}
+    with open(path, "wb") as f:
+        for i in range(blocks):
+            f.write(block)
+            if i in at: f.write(f"2026-01-01T12:00:00 {at[i]}\n".encode())
+    return os.path.getsize(path)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=int, default=200, help="size of the generated log")
+    ap.add_argument("--queries", type=int, default=30)
+    ap.add_argument("--seed", type=int, default=3)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="ai_studio_retrieval_")
+    log = os.path.join(tmp, "server.log")
+    size = write_log(log, args.mb, rng)
+
+    index = studio.FileIndex(os.path.join(tmp, "index.db"))
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    file_id, chunks = index.ensure(log)
+    took = time.perf_counter() - t0
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"index   {size / 2**20:8.1f} MB in {took:6.2f} s = {size / 2**20 / took:6.1f} MB/s | {chunks} chunks | "
+          f"peak RSS +{(rss1 - rss0) / 1024:.0f} MB | index {os.path.getsize(index.path) / 2**20:.0f} MB")
+
+    found, times = 0, []
+    questions = list(NEEDLES.items())
+    for i in range(args.queries):
+        question, needle = questions[i % len(questions)]
+        t0 = time.perf_counter()
+        ranked, total = index.retrieve(log, question)
+        times.append(time.perf_counter() - t0)
+        found += any(needle in text for _, text, _ in ranked)
+    print(f"query   p50 {statistics.median(times) * 1000:7.2f} ms | max {max(times) * 1000:7.2f} ms | "
+          f"needle in top-{studio.RETRIEVE_TOP_K}: {found}/{args.queries}")
+
+    with open(log, "r", encoding="utf-8", errors="ignore") as f: head = f.read(2000)
+    print(f"old     first 2000 chars contain a needle: {any(n in head for n in NEEDLES.values())}")
+
+    t0 = time.perf_counter()
+    index.ensure(log)
+    print(f"reuse   unchanged file looked up in {(time.perf_counter() - t0) * 1000:.2f} ms")
+
+    other = os.path.join(tmp, "access.log")
+    with open(other, "w") as f:
+        for i in range(20000): f.write(f"10.0.{i % 256}.{i % 100} GET /static/app.js 200 {i % 997} bytes\n")
+    builder = studio.ContextBuilder(index=index)
+    for order in ([other, log], [log, other]):
+        found = 0
+        for question, needle in questions:
+            msgs, _ = builder.build(studio.SYSTEM_PERSONA, [], order, [], question)
+            found += needle in msgs[-1]["content"]
+        print(f"multi   {' + '.join(os.path.basename(p) for p in order)}: needle in prompt {found}/{len(questions)}")
+        assert found == len(questions)
+
+if __name__ == "__main__":
+    main()
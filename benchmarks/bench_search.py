@@ -0,0 +1,57 @@
+# Full-text search over a synthetic chat corpus: indexing throughput while turns are
+# appended through ChatStore, then ranked-search latency for a few query shapes.
+#   python -m benchmarks.bench_search --chats 2000 --messages 20
+import argparse, os, random, statistics, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+
+VOCAB = ("network ping latency router firmware python script error traceback install driver "
+         "memory leak cpu usage disk partition backup restore password reset email calendar "
+         "invoice budget recipe travel flight hotel weather forecast garden tomato docker "
+         "container kubernetes deploy commit branch merge conflict review ipconfig gateway").split()
+
+# Real words first, then a long tail of synthetic ones; word frequency follows Zipf (1/rank)
+WORDS = VOCAB + [f"term{i}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+def sentence(rng, n):
+    return " ".join(rng.choices(WORDS, WEIGHTS, k=n))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=2000)
+    ap.add_argument("--messages", type=int, default=20)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    root = tempfile.mkdtemp(prefix="search_bench_")
+    store = studio.ChatStore(os.path.join(root, "chats.db"), legacy_dir=os.path.join(root, "none"))
+    print(f"fts5 available: {store.db is not None and store.has_fts}")
+
+    t0 = time.perf_counter()
+    for c in range(args.chats):
+        for m in range(0, args.messages, 2):
+            store.append(f"chat_{c}", [{"role": "user", "content": sentence(rng, 12)},
+                                       {"role": "assistant", "content": sentence(rng, 40)}])
+    elapsed = time.perf_counter() - t0
+    total = args.chats * args.messages
+    print(f"indexed {total} messages in {elapsed:.2f} s ({total / elapsed:.0f} msg/s, appended one turn at a time)")
+
+    for label, make in (("common word", lambda: VOCAB[rng.randint(0, 3)]),
+                        ("rare word", lambda: VOCAB[rng.randint(30, len(VOCAB) - 1)]),
+                        ("two words", lambda: f"{rng.choice(VOCAB)} {rng.choice(VOCAB)}"),
+                        ("prefix", lambda: rng.choice(VOCAB)[:3])):
+        times, hits = [], 0
+        for _ in range(args.queries):
+            q = make()
+            t0 = time.perf_counter()
+            hits += len(store.search(q, limit=20))
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        print(f"{label:<12} p50 {statistics.median(times):7.2f} ms | p95 {times[int(len(times) * 0.95) - 1]:7.2f} ms | avg hits {hits / args.queries:.1f}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
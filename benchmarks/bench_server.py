@@ -0,0 +1,135 @@
+# Load test for the headless API (MacroMoEBackend.APIServer) against the mock Ollama:
+# concurrent OpenAI-style clients, half streaming over SSE, half keeping a server-side
+# session. Reports throughput, time-to-first-token and latency, walks the explicit
+# command-approval step, then overfills the queue to check it answers 429 instead of piling
+# up, and checks a dead Ollama is reported as an error rather than as an answer. Also checks
+# that importing the backend never pulls in tkinter.
+#   python -m benchmarks.bench_server --clients 16 --requests 10
+import argparse, http.client, json, os, statistics, sys, tempfile, threading, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama, ScriptedReply
+
+def call(port, method, path, body=None, stream=False):
+    # -> (status, parsed JSON | list of SSE payloads, seconds to first content chunk)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    t0 = time.perf_counter()
+    conn.request(method, path, json.dumps(body) if body is not None else None, {"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    if not stream or resp.status != 200:
+        data = json.loads(resp.read() or b"null")
+        conn.close()
+        return resp.status, data, time.perf_counter() - t0
+    events, first = [], None
+    for line in resp:
+        if not line.startswith(b"data: "): continue
+        payload = line[6:].strip()
+        if payload == b"[DONE]": break
+        event = json.loads(payload)
+        if first is None and "choices" in event and event["choices"][0]["delta"].get("content"): first = time.perf_counter() - t0
+        events.append(event)
+    conn.close()
+    return resp.status, events, first
+
+def client(port, n, i, results):
+    session = f"bench_{i}" if i % 2 else None
+    for j in range(n):
+        body = {"model": "macro-moe", "messages": [{"role": "user", "content": f"client {i} question {j}"}], "stream": j % 2 == 0}
+        if session: body["session_id"] = session
+        t0 = time.perf_counter()
+        status, data, first = call(port, "POST", "/v1/chat/completions", body, stream=body["stream"])
+        total = time.perf_counter() - t0
+        if status != 200:
+            results.append({"status": status})
+            continue
+        if body["stream"]:
+            text = "".join(e["choices"][0]["delta"].get("content", "") for e in data)
+            approvals = [e["approval"] for e in data if "approval" in e]
+        else:
+            text, approvals, first = data["choices"][0]["message"]["content"], data["approvals"], total
+        results.append({"status": status, "ttft": first, "total": total, "chars": len(text), "approvals": len(approvals)})
+
+def start(mock, workers, queue_size):
+    url = mock.url if mock else "http://127.0.0.1:9" # nothing listens on the discard port
+    backend = studio.AIBackend(studio.OllamaTransport(url, pool_size=workers), router=studio.KeywordRouter())
+    backend.telemetry = studio.Telemetry(enabled=False)
+    server = studio.APIServer(studio.SessionEngine(backend, max_workers=workers), ("127.0.0.1", 0), workers, queue_size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+    server.engine.shutdown()
+
+def burst(port, n):
+    results = []
+    threads = [threading.Thread(target=client, args=(port, 1, 2 * k, results)) for k in range(n)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=10, help="per client")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--queue", type=int, default=32)
+    ap.add_argument("--tokens-per-s", type=float, default=200.0)
+    args = ap.parse_args()
+    assert "tkinter" not in sys.modules and "customtkinter" not in sys.modules, "backend imported Tk"
+
+    reply = ScriptedReply(words=40, think_words=10, cmd_every=4)
+    with MockOllama(reply=reply, token_delay=1 / args.tokens_per_s) as mock:
+        server = start(mock, args.workers, args.queue)
+        port = server.server_address[1]
+        status, models, _ = call(port, "GET", "/v1/models")
+        print(f"models  {[m['id'] for m in models['data']]}")
+
+        results = []
+        threads = [threading.Thread(target=client, args=(port, args.requests, i, results)) for i in range(args.clients)]
+        t0 = time.perf_counter()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        wall = time.perf_counter() - t0
+        ok = [r for r in results if r["status"] == 200]
+        ttft = sorted(r["ttft"] for r in ok if r["ttft"] is not None)
+        total = sorted(r["total"] for r in ok)
+        print(f"load    {len(ok)}/{len(results)} ok in {wall:.2f} s = {len(ok) / wall:.1f} req/s | "
+              f"TTFT p50 {statistics.median(ttft) * 1000:.0f} ms | total p50/p95 {statistics.median(total) * 1000:.0f}/"
+              f"{total[int(len(total) * 0.95)] * 1000:.0f} ms | approvals requested {sum(r['approvals'] for r in ok)}")
+        assert len(ok) == len(results) and all(r["chars"] for r in ok)
+
+        # Server-side sessions keep their history
+        session = server.engine.get_session("bench_1")
+        print(f"session bench_1 holds {len(session.history)} messages, stored {server.engine.backend.store.count('bench_1')}")
+
+        # Explicit approval step
+        status, pending, _ = call(port, "GET", "/v1/approvals")
+        first = pending["data"][0]
+        status, answer, _ = call(port, "POST", f"/v1/approvals/{first['id']}", {"approve": True})
+        print(f"approve {first['command']!r} -> {answer['output']!r}")
+        assert status == 200 and answer["approved"] and "hello" in answer["output"]
+        assert call(port, "POST", f"/v1/approvals/{first['id']}", {"approve": True})[0] == 404
+        stop(server)
+
+        # Overfilled queue: 1 worker + 2 waiting, 12 at once
+        server = start(mock, 1, 2)
+        statuses = [r["status"] for r in burst(server.server_address[1], 12)]
+        print(f"burst   12 requests at 1 worker + 2 queued: {statuses.count(200)} served, {statuses.count(429)} got 429")
+        assert statuses.count(429) > 0 and statuses.count(200) + statuses.count(429) == 12
+        stop(server)
+
+    # Ollama down: an error status (or an error event once a stream has started), never a 200 answer
+    server = start(None, 1, 2)
+    port = server.server_address[1]
+    body = {"messages": [{"role": "user", "content": "hello"}]}
+    status, data, _ = call(port, "POST", "/v1/chat/completions", body)
+    sse, events, _ = call(port, "POST", "/v1/chat/completions", dict(body, stream=True), stream=True)
+    print(f"down    {status} {data['error']['message']!r} | stream ends with {events[-1]}")
+    assert status == 503 and sse == 200 and "error" in events[-1]
+    stop(server)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Startup with many stored chats (default 10k): import time of the backend (no Tk) and of the
+# GUI module, backend construction, and the sidebar work that used to run before the window
+# appeared (list every chat) vs. what runs now (first page, on a worker thread). With a
+# display, also the App's real first paint and the time until the sidebar is complete.
+# Every measurement runs in a fresh interpreter, with bytecode already compiled.
+#   python -m benchmarks.bench_startup --chats 10000
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+import MacroMoEBackend as backend_module
+out = {"import_backend_ms": (time.perf_counter() - t0) * 1000, "tk_loaded": "tkinter" in sys.modules,
+       "pil_loaded": "PIL" in sys.modules, "dir_created": os.path.exists(os.environ["AI_STUDIO_DIR"])}
+t0 = time.perf_counter()
+backend = backend_module.AIBackend(router=backend_module.KeywordRouter())
+out["backend_init_ms"] = (time.perf_counter() - t0) * 1000
+t0 = time.perf_counter()
+out["listed"] = len(backend.get_chat_list())
+out["list_all_ms"] = (time.perf_counter() - t0) * 1000
+backend.store.close()
+backend = backend_module.AIBackend(router=backend_module.KeywordRouter())
+t0 = time.perf_counter()
+backend.get_chat_list(limit=int(os.environ["PROBE_PAGE"]))
+out["first_page_ms"] = (time.perf_counter() - t0) * 1000
+try:
+    t0 = time.perf_counter()
+    import MacroMoEStudio
+    out["import_gui_ms"] = (time.perf_counter() - t0) * 1000
+except ImportError as e:
+    out["import_gui_ms"] = None
+print(json.dumps(out))
+"""
+
+GUI_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import MacroMoEStudio as studio
+from MacroMoEBackend import AIBackend, KeywordRouter
+app = studio.App(AIBackend(router=KeywordRouter()))
+out = {}
+def painted(e=None):
+    if "first_paint_ms" not in out: out["first_paint_ms"] = (time.perf_counter() - t0) * 1000
+def poll():
+    if len(app.history_ids) >= int(sys.argv[1]):
+        out["sidebar_full_ms"] = (time.perf_counter() - t0) * 1000
+        print(json.dumps(out))
+        app.destroy()
+    else:
+        app.after(5, poll)
+app.bind("<Map>", painted, add="+")
+app.after(0, poll)
+app.mainloop()
+"""
+
+def make_chats(base_dir, n):
+    env = dict(os.environ, AI_STUDIO_DIR=base_dir)
+    code = ("import MacroMoEBackend as s, time\n"
+            "store = s.ChatStore()\n"
+            f"for i in range({n}):\n"
+            "    store.append(f'chat_{1700000000 + i}', [{'role': 'user', 'content': f'question {i} about the network'},"
+            " {'role': 'assistant', 'content': 'an answer with a few words in it'}], when=1700000000 + i)\n")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True)
+
+def run(code, env, *args):
+    proc = subprocess.run([sys.executable, "-c", code, *args], cwd=ROOT, env=env, capture_output=True, text=True, timeout=300)
+    if proc.returncode: raise SystemExit(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=10000)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--page", type=int, default=200, help="HISTORY_LIST_PAGE of the GUI")
+    args = ap.parse_args()
+    base_dir = tempfile.mkdtemp(prefix="ai_studio_startup_")
+    t0 = time.perf_counter()
+    make_chats(base_dir, args.chats)
+    print(f"setup   {args.chats} chats stored in {time.perf_counter() - t0:.1f} s")
+
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    env.update(AI_STUDIO_DIR=base_dir, PROBE_PAGE=str(args.page))
+    # First run on a data dir that doesn't exist yet: compiles bytecode, and import must not create it
+    empty = run(PROBE, dict(env, AI_STUDIO_DIR=os.path.join(tempfile.mkdtemp(), "ai_studio")))
+    results = [run(PROBE, env) for _ in range(args.runs)]
+
+    med = lambda key: statistics.median(r[key] for r in results)
+    print(f"import  backend {med('import_backend_ms'):6.1f} ms (tkinter loaded: {results[0]['tk_loaded']}, "
+          f"Pillow loaded: {results[0]['pil_loaded']}, data dir created on import: {empty['dir_created']})")
+    if results[0]["import_gui_ms"] is not None: print(f"import  GUI module {med('import_gui_ms'):6.1f} ms on top")
+    print(f"init    AIBackend() {med('backend_init_ms'):6.1f} ms")
+    print(f"sidebar old: all {results[0]['listed']} chats before the window, {med('list_all_ms'):6.1f} ms | "
+          f"new: first {args.page} after it, {med('first_page_ms'):6.1f} ms")
+    assert not results[0]["tk_loaded"] and not empty["dir_created"]
+
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        print("gui     skipped: no display (set DISPLAY, or run on Windows/macOS, for first paint)")
+        return
+    gui = [run(GUI_PROBE, env, str(args.chats)) for _ in range(args.runs)]
+    print(f"gui     first paint {statistics.median(g['first_paint_ms'] for g in gui):6.1f} ms | "
+          f"sidebar complete {statistics.median(g['sidebar_full_ms'] for g in gui):6.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# TagStreamFilter vs. the old per-chunk <think> filter + final regex pass.
+# Before timing, fuzzes the filter: every sample is re-fed split at every possible
+# chunk boundary (and char by char) and must give the same visible text, reasoning
+# and commands as a single-chunk feed and as the regex reference.
+#   python -m benchmarks.bench_tag_filter
+import argparse, os, random, re, tempfile, time
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+
+SAMPLES = [
+    "plain answer without any tags",
+    "<think>hidden</think>visible",
+    "before <think>step 1\nstep 2</think> after",
+    "Checking now. <cmd>ipconfig</cmd>",
+    "<think>maybe <cmd>dir</cmd>?</think>Sure: <cmd> ping 8.8.8.8 </cmd> and <cmd>whoami</cmd>",
+    "a < b and b <= c, <thin is not a tag, </think stray, <cmd without close",
+    "<think>unterminated reasoning that never closes",
+    "<think>x<think>nested</think>tail",
+    "<<think>>double</think>>",
+    "text ending in a partial tag <thi",
+    "<cmd>echo <b>bold</b></cmd> done </cmd>",
+    "",
+]
+
+def reference(s):
+    visible = re.sub(r"<think>.*?(</think>|$)", "", s, flags=re.DOTALL)
+    thinking = "".join(m.group(1) for m in re.finditer(r"<think>(.*?)(?:</think>|$)", s, flags=re.DOTALL))
+    return visible, thinking, [c.strip() for c in re.findall(r"<cmd>(.*?)</cmd>", visible, flags=re.DOTALL)]
+
+def run_filter(chunks):
+    f = studio.TagStreamFilter()
+    streamed = []
+    for c in chunks:
+        streamed += [d for k, d in f.feed(c) if k == "text"]
+    streamed += [d for k, d in f.flush() if k == "text"]
+    assert "".join(streamed) == f.text, "streamed text differs from accumulated text"
+    return f.text, f.thinking, f.commands
+
+def splits(s):
+    yield [s]
+    yield list(s)
+    for i in range(len(s) + 1):
+        yield [s[:i], s[i:]]
+        for j in range(i, len(s) + 1): yield [s[:i], s[i:j], s[j:]]
+
+def fuzz(rounds):
+    checked = 0
+    rng = random.Random(1234)
+    for s in SAMPLES:
+        expected = run_filter([s])
+        if "<cmd>echo <b>" not in s: assert expected == reference(s), (s, expected, reference(s))
+        for chunks in splits(s):
+            assert run_filter(chunks) == expected, (s, chunks)
+            checked += 1
+        for _ in range(rounds):
+            cuts = sorted(rng.sample(range(len(s) + 1), min(len(s) + 1, rng.randint(1, 8))))
+            chunks = [s[a:b] for a, b in zip([0] + cuts, cuts + [len(s)])]
+            assert run_filter(chunks) == expected, (s, chunks)
+            checked += 1
+    return checked
+
+def legacy(chunks):
+    # The generate() loop before TagStreamFilter, minus the callbacks
+    full_res, buffer, is_thinking, out = "", "", False, []
+    for text in chunks:
+        full_res += text
+        buffer += text
+        while True:
+            if is_thinking:
+                end_idx = buffer.find("</think>")
+                if end_idx != -1:
+                    is_thinking = False
+                    buffer = buffer[end_idx+8:]
+                else:
+                    if len(buffer) > 50: buffer = buffer[-20:]
+                    break
+            else:
+                start_idx = buffer.find("<think>")
+                if start_idx != -1:
+                    if start_idx > 0: out.append(buffer[:start_idx])
+                    is_thinking = True
+                    buffer = buffer[start_idx+7:]
+                else:
+                    potential_tag = False
+                    for i in range(1, 8):
+                        if buffer.endswith("<think>"[:i]):
+                            potential_tag = True
+                            break
+                    if not potential_tag:
+                        out.append(buffer)
+                        buffer = ""
+                    break
+    re.search(r"<cmd>(.*?)</cmd>", full_res, re.DOTALL)
+    return re.sub(r"<think>.*?</think>", "", full_res, flags=re.DOTALL).strip()
+
+def current(chunks):
+    f = studio.TagStreamFilter()
+    for c in chunks: f.feed(c)
+    f.flush()
+    return f.text.strip()
+
+def make_stream(tokens):
+    words = ["The", " answer", " is", " 42", ",", " because", " a < b", " and", " <b>", " x", "\n"]
+    think = ["<think>"] + [words[i % len(words)] for i in range(tokens // 2)] + ["</think>"]
+    body = [words[i % len(words)] for i in range(tokens // 2)] + ["<cmd>", "whoami", "</cmd>"]
+    return think + body
+
+def bench(name, fn, chunks, repeat):
+    best = min(timed(fn, chunks) for _ in range(repeat))
+    chars = sum(len(c) for c in chunks)
+    print(f"{name:<8} {best * 1000:8.2f} ms | {best / len(chunks) * 1e6:6.2f} us/chunk | {chars / best / 1e6:6.2f} MB/s")
+
+def timed(fn, chunks):
+    t0 = time.perf_counter()
+    fn(chunks)
+    return time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tokens", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--fuzz-rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    print(f"fuzz: {fuzz(args.fuzz_rounds)} chunkings OK")
+    tokens = make_stream(args.tokens)
+    for label, chunks in (("token-sized chunks", tokens), ("1-char chunks", list("".join(tokens)))):
+        assert legacy(chunks) == current(chunks)
+        print(f"-- {label} ({len(chunks)} chunks)")
+        bench("legacy", legacy, chunks, args.repeat)
+        bench("filter", current, chunks, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Per-request latency: fresh urllib connection per call (old generate() path)
+# vs. the pooled keep-alive OllamaTransport.
+#   python -m benchmarks.bench_transport -n 500
+import argparse, json, os, statistics, tempfile, time, urllib.request
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+BODY = {"model": "gemma3:4b", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+def run_urllib(base_url, n):
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        req = urllib.request.Request(base_url + "/api/chat", data=json.dumps(BODY).encode('utf-8'))
+        with urllib.request.urlopen(req, timeout=30) as response:
+            for line in response: pass
+        times.append(time.perf_counter() - t0)
+    return times
+
+def run_pooled(transport, n):
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        with transport.request("POST", "/api/chat", BODY, timeout=30) as response:
+            for line in response: pass
+        times.append(time.perf_counter() - t0)
+    return times
+
+def summarize(name, times, connections):
+    ms = sorted(t * 1000 for t in times)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"{name:<10} mean {statistics.mean(ms):7.3f} ms | p50 {statistics.median(ms):7.3f} ms | p95 {p95:7.3f} ms | connections {connections}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=300, help="requests per transport")
+    args = ap.parse_args()
+
+    with MockOllama() as mock:
+        run_urllib(mock.url, 10)  # warm up the server threads
+        before = mock.stats["connections"]
+        times = run_urllib(mock.url, args.n)
+        summarize("urllib", times, mock.stats["connections"] - before)
+
+        transport = studio.OllamaTransport(mock.url)
+        before = mock.stats["connections"]
+        times = run_pooled(transport, args.n)
+        summarize("pooled", times, mock.stats["connections"] - before)
+        print(f"pool stats: {transport.stats}")
+
+        # /api/tags and /api/ps ride the same pool
+        transport.get_json("/api/tags"), transport.get_json("/api/ps")
+        transport.close()
+
+if __name__ == "__main__":
+    main()
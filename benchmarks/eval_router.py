@@ -0,0 +1,121 @@
+# Offline routing evaluation: accuracy and added latency of the legacy substring
+# triggers, the whole-word KeywordRouter and the SemanticRouter on a labelled set.
+# Accuracy only means something with a real embedding model (--host); against the mock
+# the vectors are hashed words, so that run measures the router's added latency.
+#   python -m benchmarks.eval_router --host http://localhost:11434 --model nomic-embed-text
+#   python -m benchmarks.eval_router -v        # offline: mock /api/embed + local hashing vectors
+import argparse, os, re, statistics, tempfile, time, zlib
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama
+
+# Disjoint from studio.ROUTER_EXAMPLES; includes the known substring misroutes
+LABELLED = [
+    ("logic", "Can you debug this stack trace from my Flask app?"),
+    ("logic", "Write a bash script that renames all jpg files"),
+    ("logic", "What's 17% of 2340?"),
+    ("logic", "Integrate 1/(1+x^2) from 0 to 1"),
+    ("logic", "Refactor this class to use dependency injection"),
+    ("logic", "ping 1.1.1.1"),
+    ("logic", "ls -la"),
+    ("logic", "Show me my network adapters"),
+    ("logic", "Why is my wifi dropping packets?"),
+    ("logic", "Plan the rollout of the new API version in three phases"),
+    ("logic", "Convert this recursive function to an iterative one"),
+    ("logic", "How many bytes are in 3.5 gigabytes?"),
+    ("logic", "Check which ports are listening on this machine"),
+    ("logic", "Write a regex that matches email addresses"),
+    ("logic", "What does this C pointer arithmetic do?"),
+    ("logic", "Estimate the time complexity of merge sort"),
+    ("logic", "Run whoami"),
+    ("logic", "Find the eigenvalues of [[2,1],[1,2]]"),
+    ("logic", "My Docker container can't reach the internet, help"),
+    ("logic", "Compute the standard deviation of 4, 8, 15, 16, 23, 42"),
+    ("chat", "Hey there!"),
+    ("chat", "Good morning, what's up?"),
+    ("chat", "Explain why the sky is blue"),
+    ("chat", "Tell me something else interesting"),
+    ("chat", "My mom calls me every Sunday, what gift should I get her?"),
+    ("chat", "Can you explain the French revolution briefly?"),
+    ("chat", "Write a haiku about autumn leaves"),
+    ("chat", "What's a good name for a golden retriever?"),
+    ("chat", "Suggest a vegetarian lasagna recipe"),
+    ("chat", "Who won the 2018 football world cup?"),
+    ("chat", "I'm feeling stressed, any advice?"),
+    ("chat", "Describe a sunset over the mountains"),
+    ("chat", "What's the difference between a crocodile and an alligator?"),
+    ("chat", "Thank you so much!"),
+    ("chat", "Recommend a sci-fi movie for tonight"),
+    ("chat", "Tell me about the history of the Eiffel tower"),
+    ("chat", "How should I plant tulip bulbs?"),
+    ("chat", "Explain what a black hole is to a child"),
+    ("chat", "What are the rules of chess castling?"),
+    ("chat", "Write a thank-you note to my teacher"),
+    ("chat", "Which planet has the most moons?"),
+    ("chat", "How do I get dirty grass stains out of jeans?"),
+    ("chat", "Is a codependent friendship bad for me?"),
+    ("chat", "Which foods are high in calcium?"),
+]
+
+class HashingEmbedder:
+    # Dependency-free baseline vectors: hashed words + char trigrams
+    def __init__(self, dims=512):
+        self.dims = dims
+
+    def __call__(self, texts):
+        out = []
+        for text in texts:
+            vec = [0.0] * self.dims
+            for word in re.findall(r"\w+", text.lower()):
+                vec[zlib.crc32(word.encode()) % self.dims] += 2.0
+                padded = f" {word} "
+                for i in range(len(padded) - 2):
+                    vec[zlib.crc32(padded[i:i+3].encode()) % self.dims] += 1.0
+            out.append(vec)
+        return out
+
+def legacy_route(prompt):
+    return ("logic" if any(w in prompt.lower() for w in studio.LOGIC_TRIGGERS) else "chat"), 1.0, "legacy"
+
+def evaluate(name, route, verbose=False):
+    correct, times, sources, misses = 0, [], {}, []
+    for expected, prompt in LABELLED:
+        t0 = time.perf_counter()
+        expert, _, source = route(prompt)
+        times.append((time.perf_counter() - t0) * 1000)
+        sources[source] = sources.get(source, 0) + 1
+        if expert == expected: correct += 1
+        else: misses.append(prompt)
+    times.sort()
+    print(f"{name:<22} accuracy {correct / len(LABELLED):6.1%} | p50 {statistics.median(times):7.3f} ms | "
+          f"p95 {times[int(len(times) * 0.95) - 1]:7.3f} ms | sources {sources}")
+    if verbose:
+        for prompt in misses: print(f"    miss: {prompt}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", help="real Ollama URL; default runs against the mock")
+    ap.add_argument("--model", default=studio.EMBED_MODEL)
+    ap.add_argument("--margin", type=float, default=studio.ROUTER_MIN_MARGIN)
+    ap.add_argument("-v", "--verbose", action="store_true", help="list misrouted prompts")
+    args = ap.parse_args()
+
+    evaluate("legacy substring", legacy_route, args.verbose)
+    evaluate("keyword (whole word)", studio.KeywordRouter().route, args.verbose)
+    evaluate("semantic (hashing)", studio.SemanticRouter(HashingEmbedder(), min_margin=args.margin).route, args.verbose)
+
+    mock = None if args.host else MockOllama(embed_delay=0.002).start()
+    transport = studio.OllamaTransport(args.host or mock.url)
+    router = studio.SemanticRouter(studio.OllamaEmbedder(transport, args.model), min_margin=args.margin)
+    t0 = time.perf_counter()
+    router.centroids = router.build_centroids()
+    print(f"centroids built in {(time.perf_counter() - t0) * 1000:.1f} ms ({'ollama' if args.host else 'mock'} /api/embed)")
+    label = "ollama" if args.host else "mock"
+    evaluate(f"semantic ({label}, cold)", router.route, args.verbose)
+    evaluate(f"semantic ({label}, cached)", router.route, args.verbose)
+    print(f"router stats: {router.stats}")
+    if mock: mock.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# Local stand-in for the Ollama HTTP API. Speaks HTTP/1.1 keep-alive and streams
+# NDJSON over chunked transfer encoding, the same way `ollama serve` does.
+import json, re, sys, threading, time, zlib
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Hello! I am a mock expert and this is a short streamed answer."
+MODEL_SIZE = 4 * 2**30
+
+def keep_alive_seconds(value):
+    # Ollama accepts durations ("5m", "30s", "1h"), plain seconds, 0 (unload now) and negatives (forever)
+    if value is None: return 300
+    if isinstance(value, (int, float)): return float(value)
+    m = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value).strip())
+    if not m: return 300
+    return float(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[m.group(2)]
+
+class ScriptedReply:
+    # Reply generator for workloads: `words` of visible answer, optionally preceded by a
+    # <think> block of `think_words`, with a <cmd> on every `cmd_every`-th request
+    FILLER = "the quick brown fox jumps over the lazy dog while the model keeps talking".split()
+
+    def __init__(self, words=40, think_words=0, cmd_every=0, command="echo hello"):
+        self.words, self.think_words, self.cmd_every, self.command = words, think_words, cmd_every, command
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, body):
+        with self.lock:
+            self.calls += 1
+            n = self.calls
+        text = " ".join(self.FILLER[i % len(self.FILLER)] for i in range(self.words))
+        if self.cmd_every and n % self.cmd_every == 0: text += f" <cmd>{self.command}</cmd>"
+        if self.think_words:
+            text = "<think> " + " ".join(self.FILLER[i % len(self.FILLER)] for i in range(self.think_words)) + " </think> " + text
+        return text
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # concurrency benchmarks open many sockets at once
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream (STOP) is expected, not a server error
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+class MockOllama:
+    # Model residency is simulated: a model not in `loaded` costs `load_delay` seconds, at most
+    # `max_loaded` stay resident (LRU eviction, 0 = unlimited) and keep_alive expires after
+    # keep_alive * `time_scale` real seconds. Prompt evaluation costs `prompt_token_delay`
+    # per token not covered by the prefix cached from the model's previous request, and
+    # images `image_delay` seconds per MB of base64 payload (decode + vision preprocessing).
+    def __init__(self, reply=DEFAULT_REPLY, token_delay=0.0, embed_delay=0.0, load_delay=0.0,
+                 max_loaded=0, time_scale=1.0, prompt_token_delay=0.0, image_delay=0.0, host="127.0.0.1", port=0):
+        self.reply = reply
+        self.image_delay = image_delay
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.kv = {} # model -> tokens of its last prompt + reply (Ollama's cached slot)
+        self.embed_delay = embed_delay
+        self.load_delay = load_delay
+        self.max_loaded = max_loaded
+        self.time_scale = time_scale
+        self.loaded = OrderedDict()  # model -> expires_at
+        self.load_lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "loads": 0, "load_seconds": 0.0, "unloads": 0, "image_bytes": 0}
+        self.requests = deque(maxlen=100)
+        self.lock = threading.Lock()
+        self.server = MockServer((host, port), self.make_handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+    def count(self, key):
+        with self.lock: self.stats[key] += 1
+
+    def ensure_loaded(self, model, keep_alive):
+        # -> seconds spent loading (0 if already resident); Ollama loads one model at a time
+        with self.load_lock:
+            now = time.time()
+            for name, expires in list(self.loaded.items()):
+                if expires <= now: del self.loaded[name]
+            ttl = keep_alive_seconds(keep_alive)
+            expires = float("inf") if ttl < 0 else now + ttl * self.time_scale
+            if model in self.loaded:
+                self.loaded.move_to_end(model)
+                self.loaded[model] = expires
+                return 0.0
+            if self.max_loaded and len(self.loaded) >= self.max_loaded: self.kv.pop(self.loaded.popitem(last=False)[0], None)
+            self.kv.pop(model, None)
+            if self.load_delay: time.sleep(self.load_delay)
+            self.loaded[model] = time.time() + (expires - now)
+            with self.lock:
+                self.stats["loads"] += 1
+                self.stats["load_seconds"] += self.load_delay
+            return self.load_delay
+
+    def unload(self, model):
+        with self.load_lock:
+            self.kv.pop(model, None)
+            if self.loaded.pop(model, None) is not None:
+                with self.lock: self.stats["unloads"] += 1
+
+    def generate(self, handler, body):
+        # Only the "load/unload a model" form of /api/generate (no prompt) is supported
+        model = body.get("model", "mock")
+        if keep_alive_seconds(body.get("keep_alive")) == 0:
+            self.unload(model)
+            load = 0.0
+        else:
+            load = self.ensure_loaded(model, body.get("keep_alive"))
+        handler.send_json({"model": model, "response": "", "done": True, "load_duration": int(load * 1e9)})
+
+    def ps(self, handler):
+        now = time.time()
+        with self.load_lock:
+            names = [name for name, expires in self.loaded.items() if expires > now]
+        handler.send_json({"models": [{"name": n, "model": n, "size": MODEL_SIZE, "size_vram": MODEL_SIZE} for n in names]})
+
+    def tokens_for(self, body):
+        # Split on spaces but keep them attached, like a real tokenizer stream
+        reply = self.reply(body) if callable(self.reply) else self.reply
+        return [w + " " for w in reply.split(" ")[:-1]] + [reply.split(" ")[-1]]
+
+    def prompt_eval(self, model, body, reply):
+        # -> tokens evaluated: everything after the longest common prefix with the cached slot
+        prompt = []
+        for m in body.get("messages", []): prompt += [f"<{m.get('role')}>"] + m.get("content", "").split()
+        with self.load_lock:
+            cached = self.kv.get(model, [])
+            common = 0
+            for a, b in zip(prompt, cached):
+                if a != b: break
+                common += 1
+            self.kv[model] = prompt + ["<assistant>"] + reply.split()
+        return len(prompt) - common
+
+    def chat(self, handler, body):
+        model = body.get("model", "mock")
+        load = self.ensure_loaded(model, body.get("keep_alive"))
+        tokens = self.tokens_for(body)
+        evaluated = self.prompt_eval(model, body, "".join(tokens))
+        if self.prompt_token_delay: time.sleep(evaluated * self.prompt_token_delay)
+        image_bytes = sum(len(img) for m in body.get("messages", []) for img in m.get("images") or [])
+        if image_bytes:
+            with self.lock: self.stats["image_bytes"] += image_bytes
+            if self.image_delay: time.sleep(image_bytes / 2**20 * self.image_delay)
+        handler.start_stream()
+        for tok in tokens:
+            if self.token_delay: time.sleep(self.token_delay)
+            handler.send_chunk({"model": model, "message": {"role": "assistant", "content": tok}, "done": False})
+        handler.send_chunk({"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                            "eval_count": len(tokens), "eval_duration": int(len(tokens) * self.token_delay * 1e9),
+                            "load_duration": int(load * 1e9), "prompt_eval_count": evaluated,
+                            "prompt_eval_duration": int(evaluated * self.prompt_token_delay * 1e9)})
+        handler.end_stream()
+
+    def embed(self, handler, body):
+        # Deterministic stand-in vectors: hashed bag of words, 256 dims
+        texts = body.get("input", [])
+        if isinstance(texts, str): texts = [texts]
+        if self.embed_delay: time.sleep(self.embed_delay)
+        vectors = []
+        for text in texts:
+            vec = [0.0] * 256
+            for word in re.findall(r"\w+", text.lower()): vec[zlib.crc32(word.encode()) % 256] += 1.0
+            vectors.append(vec)
+        handler.send_json({"model": body.get("model", "mock"), "embeddings": vectors})
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Go's net/http (ollama serve) sets TCP_NODELAY too
+
+            def setup(self):
+                super().setup()
+                mock.count("connections")
+
+            def log_message(self, *args): pass
+
+            def read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def send_json(self, obj, status=200):
+                data = json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def start_stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def send_chunk(self, obj):
+                data = json.dumps(obj).encode() + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def end_stream(self):
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                mock.count("requests")
+                if self.path == "/api/tags": self.send_json({"models": []})
+                elif self.path == "/api/ps": mock.ps(self)
+                else: self.send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                mock.count("requests")
+                body = self.read_body()
+                with mock.lock: mock.requests.append((self.path, body))
+                if self.path == "/api/chat": mock.chat(self, body)
+                elif self.path == "/api/embed": mock.embed(self, body)
+                elif self.path == "/api/generate": mock.generate(self, body)
+                else: self.send_json({"error": "not found"}, 404)
+
+        return Handler
+
+if __name__ == "__main__":
+    # Stand-alone server, e.g. to point the GUI at it: AI_OLLAMA_HOST=http://127.0.0.1:11435
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--tokens-per-s", type=float, default=50.0)
+    ap.add_argument("--words", type=int, default=40)
+    ap.add_argument("--think-words", type=int, default=0)
+    ap.add_argument("--cmd-every", type=int, default=0)
+    ap.add_argument("--load-delay", type=float, default=0.0)
+    args = ap.parse_args()
+    mock = MockOllama(reply=ScriptedReply(args.words, args.think_words, args.cmd_every), token_delay=1 / args.tokens_per_s,
+                      load_delay=args.load_delay, port=args.port)
+    print(f"mock Ollama on {mock.url}")
+    mock.server.serve_forever()
@@ -0,0 +1,165 @@
+# Regression suite: scripted workloads through AIBackend.generate() against the mock Ollama
+# (NDJSON at --tokens-per-s, with <think> blocks and the occasional <cmd>). Reports throughput,
+# time-to-first-token, total latency, history-save cost and memory per workload, as JSON so
+# runs can be compared. Headless: never touches Tk.
+#   python -m benchmarks.suite --out before.json
+#   python -m benchmarks.suite --out after.json --compare before.json
+import argparse, json, os, platform, random, subprocess, sys, tempfile, time, tracemalloc
+
+os.environ.setdefault("AI_STUDIO_DIR", tempfile.mkdtemp(prefix="ai_studio_bench_"))
+import MacroMoEBackend as studio
+from benchmarks.mock_ollama import MockOllama, ScriptedReply
+
+try:
+    import resource
+except ImportError:
+    resource = None # Windows: no peak RSS
+
+COMPARE = ("throughput_turns_s", "ttft_ms_p50", "total_ms_p50", "total_ms_p95", "save_ms_p50", "py_peak_mb")
+
+def rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 1024), 1)
+
+def make_backend(mock):
+    backend = studio.AIBackend(studio.OllamaTransport(mock.url, pool_size=16), router=studio.KeywordRouter())
+    backend.telemetry = studio.Telemetry(enabled=False, window=10**6)
+    return backend
+
+def records(backend):
+    return [r for recs in backend.telemetry.models.values() for r in recs]
+
+# ---- workloads: each returns (backend, seconds spent in turns), setup not included ----
+
+def short_chats(mock, args, tmp):
+    backend = make_backend(mock)
+    t0 = time.perf_counter()
+    for i in range(args.chats):
+        session = backend.new_session()
+        for j in range(3): backend.generate(f"hi there, quick question {i}.{j}", session=session)
+    return backend, time.perf_counter() - t0
+
+def long_history(mock, args, tmp):
+    backend = make_backend(mock)
+    rng = random.Random(1)
+    session = backend.new_session()
+    backend.store.append(session.chat_id, [{"role": ("user", "assistant")[i % 2], "content": " ".join(
+        rng.choice(ScriptedReply.FILLER) for _ in range(rng.randint(5, 120)))} for i in range(args.history)])
+    t0 = time.perf_counter()
+    session = backend.load_session(session.chat_id)
+    for j in range(args.turns): backend.generate(f"follow-up {j}: and what about the rest?", session=session)
+    return backend, time.perf_counter() - t0
+
+def files(mock, args, tmp):
+    backend = make_backend(mock)
+    notes = os.path.join(tmp, "notes.txt")
+    log = os.path.join(tmp, "server.log")
+    with open(notes, "w", encoding="utf-8") as f: f.write("release checklist: tag, build, upload, announce\n" * 200)
+    with open(log, "w", encoding="utf-8") as f:
+        for i in range(args.log_lines): f.write(f"2026-01-01 INFO worker-{i % 16} request {i} served in {i % 997} ms\n")
+        f.write("2026-01-01 ERROR disk quota exceeded on volume vol7\n")
+    t0 = time.perf_counter()
+    for j in range(args.turns):
+        backend.generate(f"why did the disk quota fail? ({j})", attached_files=[notes, log])
+    return backend, time.perf_counter() - t0
+
+def images(mock, args, tmp):
+    if not studio.HAS_PIL: return None, 0.0
+    from PIL import Image
+    backend = make_backend(mock)
+    photo = os.path.join(tmp, "photo.jpg")
+    Image.frombytes("RGB", (2400, 1800), random.Random(2).randbytes(2400 * 1800 * 3)).save(photo, quality=90)
+    t0 = time.perf_counter()
+    for j in range(max(2, args.turns // 4)): backend.generate(f"describe this photo ({j})", attached_files=[photo])
+    return backend, time.perf_counter() - t0
+
+def concurrent(mock, args, tmp):
+    engine = studio.SessionEngine(make_backend(mock), max_workers=args.workers)
+    sessions = [engine.open_session().chat_id for _ in range(args.workers * 2)]
+    t0 = time.perf_counter()
+    futures = [engine.submit(sessions[i % len(sessions)], f"parallel question {i}") for i in range(args.workers * 6)]
+    for f in futures: f.result()
+    wall = time.perf_counter() - t0
+    engine.shutdown()
+    return engine.backend, wall
+
+WORKLOADS = {"short_chats": short_chats, "long_history": long_history, "files": files, "images": images, "concurrent": concurrent}
+
+def summarize(recs, wall):
+    def pct(key, q):
+        values = [r[key] for r in recs if r.get(key) is not None]
+        return studio.percentile(values, q)
+    return {
+        "turns": len(recs),
+        "errors": sum(r["kind"] == "error" for r in recs),
+        "wall_s": round(wall, 3),
+        "throughput_turns_s": round(len(recs) / wall, 2) if wall else None,
+        "ttft_ms_p50": pct("ttft_ms", 0.5), "ttft_ms_p95": pct("ttft_ms", 0.95),
+        "total_ms_p50": pct("total_ms", 0.5), "total_ms_p95": pct("total_ms", 0.95),
+        "save_ms_p50": pct("save_ms", 0.5), "save_ms_p95": pct("save_ms", 0.95),
+        "tokens_per_s_p50": pct("tokens_per_s", 0.5),
+    }
+
+def compare(base, new):
+    print(f"\n{'workload':<14}{'metric':<20}{'base':>10}{'new':>10}{'change':>9}")
+    for name, result in new["workloads"].items():
+        old = base.get("workloads", {}).get(name) or {}
+        for key in COMPARE:
+            a, b = old.get(key), result.get(key)
+            if a is None or b is None: continue
+            change = f"{(b - a) / a:+.0%}" if a else ""
+            print(f"{name:<14}{key:<20}{a:>10}{b:>10}{change:>9}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--only", default=",".join(WORKLOADS), help="comma-separated workloads")
+    ap.add_argument("--tokens-per-s", type=float, default=400.0, help="mock generation speed")
+    ap.add_argument("--words", type=int, default=40, help="visible words per answer")
+    ap.add_argument("--think-words", type=int, default=20)
+    ap.add_argument("--cmd-every", type=int, default=5)
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--history", type=int, default=5000, help="messages already in the long chat")
+    ap.add_argument("--log-lines", type=int, default=200000)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--out", help="write results as JSON")
+    ap.add_argument("--compare", help="earlier JSON results to diff against")
+    args = ap.parse_args()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    out = {"meta": {"time": time.time(), "commit": commit, "python": platform.python_version(),
+                    "platform": platform.platform(), "args": vars(args)}, "workloads": {}}
+
+    reply = ScriptedReply(args.words, args.think_words, args.cmd_every)
+    with MockOllama(reply=reply, token_delay=1 / args.tokens_per_s) as mock:
+        for name in args.only.split(","):
+            tmp = tempfile.mkdtemp(prefix=f"ai_studio_{name}_")
+            tracemalloc.start() # slows every workload alike: compare suite runs with suite runs
+            backend, wall = WORKLOADS[name](mock, args, tmp)
+            py_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if backend is None:
+                out["workloads"][name] = {"skipped": "needs Pillow"}
+                print(f"{name:<13} skipped (needs Pillow)")
+                continue
+            result = summarize(records(backend), wall)
+            result["py_peak_mb"] = round(py_peak / 2**20, 1)
+            result["rss_peak_mb"] = rss_mb()
+            out["workloads"][name] = result
+            print(f"{name:<13} {result['turns']:4d} turns | {result['throughput_turns_s']:7.1f} turns/s | "
+                  f"TTFT p50 {result['ttft_ms_p50']} ms | total p50/p95 {result['total_ms_p50']}/{result['total_ms_p95']} ms | "
+                  f"save p50 {result['save_ms_p50']} ms | py peak {result['py_peak_mb']} MB | errors {result['errors']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(out, f, indent=2)
+        print(f"results written to {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f: compare(json.load(f), out)
+
+if __name__ == "__main__":
+    main()
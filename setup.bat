@@ -6,6 +6,7 @@ echo Pulling Ollama Models (This may take a while)...
 ollama pull gemma3:4b
 ollama pull qwen3-vl:4b
 ollama pull phi4-mini-reasoning:3.8b-q4_K_M
+ollama pull nomic-embed-text
 
 echo Setup Complete!
 echo Starting Application...